@@ -0,0 +1,237 @@
+"""
+Benchmarks converting and loading songbooks, headless. Generates synthetic songbooks with python-pptx in a temporary
+folder and runs prebuild.py on them three times:
+
+- cold: nothing converted yet
+- warm: everything converted, only the scan and cache lookups
+- stale: a part of the presentations changed since the last run
+
+For every run the wall time, peak RSS, bytes written to #converted# and the timing report of prebuild are recorded.
+Results are printed as JSON (or written with --output), so runs on different commits can be compared:
+
+    python benchmark.py --songbooks 2 --songs 20 --slides 4 --output results.json
+
+--soffice-standin replaces LibreOffice by a small PIL based renderer (see soffice_standin below), so the benchmark
+runs on a box without LibreOffice. poppler (pdfinfo, pdftoppm) is still needed.
+"""
+import argparse
+import io
+import json
+import os
+import random
+import shlex
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+from PIL import Image, ImageDraw, ImageFont
+from pptx import Presentation
+from pptx.util import Emu, Pt
+
+from converter import TEMP_FOLDER
+
+WORDS = (
+    "love night heart fire light dream road home rain sky time eyes hold run fall rise burn stay gone alone "
+    "tonight forever shadow river morning never always whisper thunder golden broken"
+).split()
+SLIDE_SIZE = (Emu(12192000), Emu(6858000))  # 16:9 like PowerPoint's default
+
+
+def generate_presentation(path, slides, lines, words, picture_ratio, rnd):
+    presentation = Presentation()
+    presentation.slide_width, presentation.slide_height = SLIDE_SIZE
+    layout = presentation.slide_layouts[6]  # blank
+    for _ in range(slides):
+        slide = presentation.slides.add_slide(layout)
+        text_box = slide.shapes.add_textbox(Emu(457200), Emu(457200), SLIDE_SIZE[0] - Emu(914400), SLIDE_SIZE[1] - Emu(914400))
+        text_frame = text_box.text_frame
+        text_frame.word_wrap = True
+        for line_number in range(lines):
+            paragraph = text_frame.paragraphs[0] if line_number == 0 else text_frame.add_paragraph()
+            paragraph.text = " ".join(rnd.choice(WORDS) for _ in range(words))
+            paragraph.runs[0].font.size = Pt(28)
+
+        # Pictures are not supported by the native renderer, these slides go through LibreOffice
+        if rnd.random() < picture_ratio:
+            picture = io.BytesIO()
+            Image.new("RGB", (64, 64), tuple(rnd.randrange(256) for _ in range(3))).save(picture, "PNG")
+            picture.seek(0)
+            slide.shapes.add_picture(picture, SLIDE_SIZE[0] - Emu(1828800), Emu(457200), Emu(1371600), Emu(1371600))
+    presentation.save(path)
+
+
+def generate_songbooks(songbooks_path, args, seed):
+    rnd = random.Random(seed)
+    paths = []
+    for songbook_number in range(1, args.songbooks + 1):
+        songbook_path = os.path.join(songbooks_path, f"{songbook_number:03d} - Songbook {songbook_number}")
+        os.makedirs(songbook_path, exist_ok=True)
+        for song_number in range(1, args.songs + 1):
+            path = os.path.join(songbook_path, f"{song_number:03d} - Artist {song_number} - Song {song_number}.pptx")
+            generate_presentation(path, args.slides, args.lines, args.words, args.picture_ratio, rnd)
+            paths.append(path)
+    return paths
+
+
+def folder_bytes(path, modified_since=None):
+    total = 0
+    for dir_path, _, file_names in os.walk(path):
+        for file_name in file_names:
+            stat = os.stat(os.path.join(dir_path, file_name))
+            if modified_since is None or stat.st_mtime_ns >= modified_since:
+                total = total + stat.st_size
+    return total
+
+
+def run_prebuild(songbooks_path, args, report_path, env):
+    """Runs prebuild.py in its own process so peak RSS is per run"""
+    command = [
+        sys.executable, os.path.join(os.path.dirname(os.path.realpath(__file__)), "prebuild.py"),
+        "--songbooks", songbooks_path,
+        "--size", args.size,
+        "--timings", report_path,
+    ]
+    if args.workers:
+        command = command + ["--workers", str(args.workers)]
+    converted_path = os.path.join(songbooks_path, TEMP_FOLDER)
+
+    started_ns = time.time_ns()
+    started = time.perf_counter()
+    process = subprocess.Popen(command, env=env, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+    output = process.stdout.read()
+    _, status, rusage = os.wait4(process.pid, 0)
+    wall = time.perf_counter() - started
+    process.returncode = os.waitstatus_to_exitcode(status)
+
+    with open(report_path) as f:
+        report = json.load(f)
+    return {
+        "exit_code": process.returncode,
+        "wall_s": round(wall, 4),
+        "user_s": round(rusage.ru_utime, 4),
+        "system_s": round(rusage.ru_stime, 4),
+        "peak_rss_bytes": rusage.ru_maxrss * 1024,  # of prebuild and the largest of its children
+        "written_bytes": folder_bytes(converted_path, started_ns),
+        "converted_bytes": folder_bytes(converted_path),
+        "stats": report["stats"],
+        "output": output.decode(errors="replace").splitlines()[-20:] if process.returncode else [],
+    }
+
+
+def soffice_standin(argv):
+    """Stand-in for `soffice --headless --convert-to pdf --outdir DIR FILE`: text in the default font, pictures grey"""
+    output_dir = argv[argv.index("--outdir") + 1]
+    path = argv[-1]
+    presentation = Presentation(path)
+    scale = 2 / 12700  # EMU to pixels at 144 dpi
+    size = (int(presentation.slide_width * scale), int(presentation.slide_height * scale))
+    font = ImageFont.load_default(56)
+    pages = []
+    for slide in presentation.slides:
+        page = Image.new("RGB", size, "black")
+        draw = ImageDraw.Draw(page)
+        for shape in slide.shapes:
+            box = [int(shape.left * scale), int(shape.top * scale)]
+            if shape.has_text_frame:
+                for paragraph in shape.text_frame.paragraphs:
+                    draw.text(box, "".join(run.text for run in paragraph.runs), fill="white", font=font)
+                    box[1] = box[1] + 68
+            else:
+                draw.rectangle(box + [box[0] + int(shape.width * scale), box[1] + int(shape.height * scale)], fill="grey")
+        pages.append(page)
+    time.sleep(float(os.environ.get("SOFFICE_STANDIN_DELAY", "0")))
+    pdf_path = os.path.join(output_dir, os.path.splitext(os.path.basename(path))[0] + ".pdf")
+    pages[0].save(pdf_path, save_all=True, append_images=pages[1:], resolution=144)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark converting and loading synthetic songbooks")
+    parser.add_argument("--songbooks", type=int, default=2)
+    parser.add_argument("--songs", type=int, default=10, help="per songbook")
+    parser.add_argument("--slides", type=int, default=4, help="per song")
+    parser.add_argument("--lines", type=int, default=8, help="text lines per slide")
+    parser.add_argument("--words", type=int, default=5, help="words per line")
+    parser.add_argument("--picture-ratio", type=float, default=0.25, help="part of the slides with a picture")
+    parser.add_argument("--stale-ratio", type=float, default=0.1, help="part of the songs changed for the stale run")
+    parser.add_argument("--size", default="1920x993", help="slide size in pixels")
+    parser.add_argument("--workers", type=int, default=0, help="default like the app")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--soffice-standin", action="store_true", help="do not use LibreOffice")
+    parser.add_argument("--soffice-delay", type=float, default=0, help="seconds the stand-in waits, like soffice's startup")
+    parser.add_argument("--keep", action="store_true", help="keep the generated songbooks")
+    parser.add_argument("--output", help="write the JSON results here instead of printing them")
+    args = parser.parse_args()
+
+    env = dict(os.environ)
+    if args.soffice_standin:
+        env["TELEPROMPTER_SOFFICE"] = shlex.join([sys.executable, os.path.realpath(__file__), "--soffice-standin-run"])
+        env["SOFFICE_STANDIN_DELAY"] = str(args.soffice_delay)
+
+    work_dir = tempfile.mkdtemp(prefix="teleprompter-benchmark-")
+    try:
+        songbooks_path = os.path.join(work_dir, "songbooks")
+        started = time.perf_counter()
+        paths = generate_songbooks(songbooks_path, args, args.seed)
+        generation_s = time.perf_counter() - started
+
+        runs = {}
+        runs["cold"] = run_prebuild(songbooks_path, args, os.path.join(work_dir, "cold.json"), env)
+        runs["warm"] = run_prebuild(songbooks_path, args, os.path.join(work_dir, "warm.json"), env)
+
+        # Change some presentations, the rest stays cached
+        rnd = random.Random(args.seed + 1)
+        stale = rnd.sample(paths, max(1, round(len(paths) * args.stale_ratio)))
+        for path in stale:
+            generate_presentation(path, args.slides, args.lines, args.words, args.picture_ratio, rnd)
+        runs["stale"] = run_prebuild(songbooks_path, args, os.path.join(work_dir, "stale.json"), env)
+
+        try:
+            commit = subprocess.run(
+                ["git", "rev-parse", "HEAD"], capture_output=True, text=True,
+                cwd=os.path.dirname(os.path.realpath(__file__))
+            ).stdout.strip() or None
+        except OSError:
+            commit = None
+
+        results = {
+            "commit": commit,
+            "date": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "config": {
+                "songbooks": args.songbooks,
+                "songs": args.songs,
+                "slides": args.slides,
+                "lines": args.lines,
+                "words": args.words,
+                "picture_ratio": args.picture_ratio,
+                "stale_songs": len(stale),
+                "size": args.size,
+                "workers": args.workers or None,
+                "cpus": os.cpu_count(),
+                "soffice": "standin" if args.soffice_standin else "libreoffice",
+                "soffice_delay": args.soffice_delay if args.soffice_standin else None,
+            },
+            "generation_s": round(generation_s, 4),
+            "presentation_bytes": folder_bytes(songbooks_path) - folder_bytes(os.path.join(songbooks_path, TEMP_FOLDER)),
+            "runs": runs,
+        }
+    finally:
+        if args.keep:
+            print(f"Songbooks kept in {work_dir}", file=sys.stderr)
+        else:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=1)
+    else:
+        print(json.dumps(results, indent=1))
+    return 1 if any(run["exit_code"] for run in runs.values()) else 0
+
+
+if __name__ == "__main__":
+    if sys.argv[1:2] == ["--soffice-standin-run"]:
+        soffice_standin(sys.argv[2:])
+    else:
+        sys.exit(main())
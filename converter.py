@@ -0,0 +1,1429 @@
+"""
+Finding songbooks and converting their presentations into slides, without any UI. Used by the app and by prebuild.py
+"""
+import atexit
+import fcntl
+import hashlib
+import heapq
+import importlib.util
+import json
+import mmap
+import os
+import re
+import shlex
+import shutil
+import signal
+import struct
+import subprocess
+import tempfile
+import time
+import zipfile
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock, Thread, Timer
+
+from PIL import Image, ImageChops
+
+from timing import timings
+
+# python-pptx, pdf2image, the native renderer and LibreOffice's Python bridge are imported where they are used.
+# They are only needed to convert, a start on a warm cache does without them
+
+SONGBOOKS_FOLDER = "songbooks"  # by default one folder up from code folder  otherwise within code folder
+TEMP_FOLDER = "#converted#"  # inside SONGBOOKS_FOLDER
+MANIFEST_FILE = "manifest.json"  # inside TEMP_FOLDER
+APP_LOCK_FILE = "app.lock"  # inside TEMP_FOLDER, held while the app runs so prebuild.py --prune keeps its slides
+CACHE_BUNDLE_FILE = "converted-bundle.zip"  # inside SONGBOOKS_FOLDER, slides converted elsewhere (prebuild.py --export-bundle)
+CONVERSION_WORKERS = 0  # presentations converted in parallel, 0 means one per CPU core
+RASTERIZE_THREADS = 0  # pages of one presentation rendered in parallel, 0 means use the cores other conversions leave free
+NATIVE_RENDERER = True  # render text only slides without LibreOffice
+SLIDE_ENCODING = "auto"  # auto stores slides without colour as greyscale (1 byte per pixel). Or force "rgb"
+PACKED_SLIDES = True  # prebuild.py packs the slides of a songbook into one file, so a warm start opens a few files only
+SLIDE_GREYSCALE_TOLERANCE = 8  # max colour deviation from grey for a slide to be stored as greyscale
+SONG_EXTENSIONS = (".pptx", ".pdf")  # a folder of images is a song as well
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg")  # slides of image folder songs, shown as they are
+TEMPO_PATTERN = re.compile(r"(\d+(?:[.,]\d+)?)\s*(bpm|s)", re.IGNORECASE)  # "120 bpm" or "40s" per slide
+TEMPO_TAG_PATTERN = re.compile(r"\[([^\]]*)\]|\btempo:\s*(\d+(?:[.,]\d+)?\s*(?:bpm|s)\b)", re.IGNORECASE)  # in metadata
+SOFFICE_COMMAND = os.environ.get("TELEPROMPTER_SOFFICE", "soffice")  # e.g. a stand-in for benchmarks
+# Keep LibreOffice running between conversions (needs python3-uno), otherwise one per song. Not for a command set with
+# TELEPROMPTER_SOFFICE, stand-ins only understand --convert-to
+SOFFICE_PERSISTENT = "TELEPROMPTER_SOFFICE" not in os.environ
+SOFFICE_TIMEOUT = 180  # seconds for one presentation, then LibreOffice is killed and the song marked as failed
+SOFFICE_START_TIMEOUT = 60  # seconds for a persistent LibreOffice to accept conversions
+SOFFICE_IDLE_TIMEOUT = 120  # seconds a persistent LibreOffice keeps running without anything to convert
+
+
+def find_songbooks_path():
+    # One folder up from the code folder, otherwise within the code folder
+    code_folder = os.path.dirname(os.path.realpath(__file__))
+    for potential_folder in (
+        os.path.join(os.path.dirname(code_folder), SONGBOOKS_FOLDER),
+        os.path.join(code_folder, SONGBOOKS_FOLDER),
+    ):
+        if os.path.exists(potential_folder):
+            return potential_folder
+    raise Exception("Could not find a songbooks folder inside of code folder or one level up")
+
+
+class ConversionManifest:
+    """
+    Remembers for every presentation the content hash, size and the images it was converted to.
+    A presentation whose size and modification time did not change is trusted without reading it. If only the
+    modification time changed (e.g. touched by git checkout), the content hash decides.
+    The app and prebuild.py may use the manifest at the same time, saving merges with the manifest on disk.
+    """
+    VERSION = 2
+
+    def __init__(self, path, songbooks_path):
+        self.path = path
+        self.songbooks_path = songbooks_path
+        self._lock = Lock()
+        self._entries = {}
+        self._dirty = False
+        self._changed = set()  # keys changed since the manifest on disk was last read or written
+        self._render_size_changed = False
+        self._disk_stat = None  # of the manifest file as last read or written
+        self.render_size = None  # last used by the app, prebuild renders for the same screen
+
+        try:
+            content = self._read()
+            if content is not None:
+                self._entries, self.render_size = content
+        except Exception as e:
+            print("Error during manifest loading, converting everything: {}".format(e))
+
+    def _read(self):
+        """Entries and render size of the manifest on disk, None if there is none of this version"""
+        try:
+            with open(self.path) as f:
+                stat = os.fstat(f.fileno())
+                content = json.load(f)
+        except FileNotFoundError:
+            return None
+        self._disk_stat = (stat.st_ino, stat.st_size, stat.st_mtime_ns)
+        if content.get("version") != self.VERSION:
+            return None
+        return content["entries"], content.get("render_size")
+
+    @staticmethod
+    def content_hash(path):
+        sha = hashlib.sha256()
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                sha.update(chunk)
+        return sha.hexdigest()
+
+    def _key(self, presentation_path):
+        return os.path.relpath(presentation_path, self.songbooks_path)
+
+    def lookup(self, presentation_path, render_key):
+        """Images of the presentation if its converted version is still valid, otherwise None"""
+        key = self._key(presentation_path)
+        with self._lock:
+            entry = self._entries.get(key)
+        if entry is None:
+            entry = self._find_moved(presentation_path, render_key)
+        if entry is None or entry.get("render") != render_key or not entry["images"]:
+            return None
+
+        stat = os.stat(presentation_path)
+        if stat.st_size != entry["size"]:
+            return None
+        if stat.st_mtime_ns != entry["mtime_ns"]:
+            if self.content_hash(presentation_path) != entry["hash"]:
+                return None
+            with self._lock:
+                entry["mtime_ns"] = stat.st_mtime_ns
+                self._changed.add(key)
+                self._dirty = True
+        converted_path = os.path.dirname(self.path)
+        images = [os.path.join(converted_path, image) for image in entry["images"]]
+        # Deleted by hand, or pruned by prebuild.py while the app was running
+        if not all(slide_exists(image) for image in images):
+            return None
+        return images
+
+    def _find_moved(self, presentation_path, render_key):
+        # A renamed or moved presentation (e.g. new sequence number) keeps its converted images
+        stat = os.stat(presentation_path)
+        with self._lock:
+            candidates = [
+                (key, entry) for key, entry in self._entries.items()
+                if entry["size"] == stat.st_size and entry.get("render") == render_key
+                and not os.path.exists(os.path.join(self.songbooks_path, key))
+            ]
+        if not candidates:
+            return None
+
+        content_hash = self.content_hash(presentation_path)
+        converted_path = os.path.dirname(self.path)
+        for old_key, entry in candidates:
+            if entry["hash"] != content_hash:
+                continue
+            if not all(slide_exists(os.path.join(converted_path, image)) for image in entry["images"]):
+                continue
+
+            # Loose slides are named after the presentation, they get the new name as well. Linked, not moved: the app
+            # may still show the song under its old name until it applies the rescan. prune deletes the old names.
+            # Packed slides are named after their content and stay where they are
+            new_key = self._key(presentation_path)
+            new_bare = os.path.join(
+                os.path.dirname(new_key),
+                slide_name_bare(os.path.basename(new_key).rsplit(".", 1)[0], entry["hash"], entry["render"])
+            )
+            os.makedirs(os.path.join(converted_path, os.path.dirname(new_key)), exist_ok=True)
+            images = []
+            for i, image in enumerate(entry["images"]):
+                if SlidePack.split(image) is not None:
+                    images.append(image)
+                    continue
+                new_image = f"{new_bare}-{i}.{image.rsplit('.', 1)[1]}"
+                tmp_path = os.path.join(converted_path, new_image) + ".tmp"
+                if os.path.exists(tmp_path):
+                    os.unlink(tmp_path)
+                try:
+                    os.link(os.path.join(converted_path, image), tmp_path)
+                except OSError:
+                    shutil.copyfile(os.path.join(converted_path, image), tmp_path)
+                os.replace(tmp_path, os.path.join(converted_path, new_image))
+                images.append(new_image)
+
+            with self._lock:
+                self._entries.pop(old_key, None)
+                entry = dict(entry, images=images)
+                self._entries[new_key] = entry
+                self._changed.update((old_key, new_key))
+                self._dirty = True
+            return entry
+        return None
+
+    def get(self, presentation_path):
+        """Entry of the presentation as stored, without checking whether it is still valid"""
+        with self._lock:
+            entry = self._entries.get(self._key(presentation_path))
+        return dict(entry) if entry is not None else None
+
+    def reusable_slides(self, presentation_path, render_key):
+        """Slides of the previous conversion of the presentation that still exist, as fingerprint -> (path, renderer)"""
+        entry = self.get(presentation_path)
+        if entry is None or entry.get("render") != render_key or not entry.get("fingerprints"):
+            return {}
+        converted_path = os.path.dirname(self.path)
+        slides = {}
+        for fingerprint, image, renderer in zip(entry["fingerprints"], entry["images"], entry["renderers"]):
+            path = os.path.join(converted_path, image)
+            if fingerprint not in slides and slide_exists(path):
+                slides[fingerprint] = (path, renderer)
+        return slides
+
+    def store(self, presentation_path, stat, content_hash, render_key, images, renderers, fingerprints=None, tempo=None):
+        """
+        stat is taken before content_hash, a presentation saved in between then fails the next lookup. Loose slides of
+        the previous conversion that images does not reuse are deleted
+        """
+        key = self._key(presentation_path)
+        converted_path = os.path.dirname(self.path)
+        with self._lock:
+            previous = self._entries.get(key)
+            self._changed.add(key)
+            self._entries[key] = {
+                "hash": content_hash,
+                "render": render_key,
+                "size": stat.st_size,
+                "mtime_ns": stat.st_mtime_ns,
+                "slides": len(images),
+                "images": [os.path.relpath(image, os.path.dirname(self.path)) for image in images],
+                "renderers": renderers,  # per slide: native, soffice or pdf
+                "fingerprints": fingerprints,  # per slide, see slide_fingerprints. None if slides and pages differ
+                "tempo": tempo,  # from the presentation's metadata, see find_tempo_tag
+            }
+            self._dirty = True
+
+        if previous is not None:
+            kept = set(self._entries[key]["images"])
+            for image in set(previous["images"]) - kept:
+                if SlidePack.split(image) is not None:
+                    continue  # removed from the pack by prune
+                try:
+                    os.unlink(os.path.join(converted_path, image))
+                except FileNotFoundError:
+                    pass
+
+    def changed_since_stored(self, presentation_path):
+        """Whether the presentation changed after the stat its entry was stored with, e.g. while it was converting"""
+        with self._lock:
+            entry = self._entries.get(self._key(presentation_path))
+        try:
+            stat = os.stat(presentation_path)
+        except FileNotFoundError:
+            return False  # removed, the next scan drops it
+        return entry is None or (stat.st_size, stat.st_mtime_ns) != (entry["size"], entry["mtime_ns"])
+
+    def set_render_size(self, render_size):
+        with self._lock:
+            if self.render_size != list(render_size):
+                self.render_size = list(render_size)
+                self._render_size_changed = True
+                self._dirty = True
+
+    def prune(self, presentation_paths):
+        """
+        Forgets presentations that are not in presentation_paths and deletes every file in the songbook folders of the
+        converted folder that no presentation refers to anymore. Returns the deleted files.
+        """
+        keys = {self._key(path) for path in presentation_paths}
+        converted_path = os.path.dirname(self.path)
+        with self._lock:
+            for key in list(self._entries):
+                if key not in keys:
+                    del self._entries[key]
+                    self._changed.add(key)
+                    self._dirty = True
+            referenced = {
+                (SlidePack.split(image) or (image,))[0] for entry in self._entries.values() for image in entry["images"]
+            }
+
+        deleted = []
+        for dir_path, _, file_names in os.walk(converted_path, topdown=False):
+            for file_name in file_names:
+                path = os.path.join(dir_path, file_name)
+                if dir_path == converted_path or os.path.relpath(path, converted_path) in referenced:
+                    continue
+                os.unlink(path)
+                deleted.append(path)
+            if dir_path != converted_path and not os.listdir(dir_path):
+                os.rmdir(dir_path)
+        return deleted
+
+    def pack(self):
+        """
+        Moves the slides of every songbook folder with loose slides into the slide pack of that folder, along with
+        the slides packed there before that are still referred to. Loose files are left for prune to delete, so a
+        running app can still load them. Returns the packed folders
+        """
+        converted_path = os.path.dirname(self.path)
+        with self._lock:
+            entries = {key: dict(entry) for key, entry in self._entries.items() if entry["images"]}
+
+        def _folder(image):
+            packed = SlidePack.split(image)
+            return os.path.dirname(packed[0] if packed is not None else image)
+
+        folders = sorted({
+            _folder(image) for entry in entries.values() for image in entry["images"] if SlidePack.split(image) is None
+        })
+        for folder in folders:
+            pack = os.path.join(folder, SlidePack.FILE_NAME)
+            slides = {}
+            repacked = {}
+            for key, entry in entries.items():
+                if _folder(entry["images"][0]) != folder:
+                    continue
+                if not all(slide_exists(os.path.join(converted_path, image)) for image in entry["images"]):
+                    # Stale, converted again when its presentation is looked up
+                    continue
+                images = []
+                for number, image in enumerate(entry["images"]):
+                    packed = SlidePack.split(image)
+                    # Named after the content, a renamed presentation still finds its slides
+                    name = packed[1] if packed is not None else f"{entry['hash'][:16]}-{entry['render']}-{number}.{RawSlide.EXTENSION}"
+                    slides[name] = os.path.join(converted_path, image)
+                    images.append(os.path.join(pack, name))
+                repacked[key] = (entry["images"], images)
+
+            with timings.span("pack", folder=folder, slides=len(slides)):
+                SlidePack.write(os.path.join(converted_path, pack), slides)
+            with self._lock:
+                for key, (old_images, images) in repacked.items():
+                    # Unless converted again in the meantime
+                    entry = self._entries.get(key)
+                    if entry is not None and entry["images"] == old_images:
+                        self._entries[key] = dict(entry, images=images)
+                        self._changed.add(key)
+                        self._dirty = True
+        return folders
+
+    def save(self):
+        with self._lock:
+            if not self._dirty:
+                return
+            self._merge()
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            tmp_path = self.path + ".tmp"
+            with open(tmp_path, "w") as f:
+                json.dump({"version": self.VERSION, "render_size": self.render_size, "entries": self._entries}, f, indent=1)
+                stat = os.fstat(f.fileno())
+            os.replace(tmp_path, self.path)
+            self._disk_stat = (stat.st_ino, stat.st_size, stat.st_mtime_ns)
+            self._changed = set()
+            self._render_size_changed = False
+            self._dirty = False
+
+    def _merge(self):
+        # Someone else saved since (prebuild.py while the app runs, or the other way round). Their entries are taken
+        # unless changed here, e.g. slides packed or pruned by prebuild.py. Called with the lock held
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return
+        if (stat.st_ino, stat.st_size, stat.st_mtime_ns) == self._disk_stat:
+            return
+        try:
+            content = self._read()
+        except Exception as e:
+            print("Error during manifest merging: {}".format(e))
+            return
+        if content is None:
+            return
+        entries, render_size = content
+        for key in self._changed:
+            if key in self._entries:
+                entries[key] = self._entries[key]
+            else:
+                entries.pop(key, None)
+        self._entries = entries
+        if not self._render_size_changed:
+            self.render_size = render_size
+
+
+class CacheBundle:
+    """
+    Converted slides packed into a single zip archive, so a fast machine can convert and the bundle is shipped with the
+    songbooks. Slides are found by render key and content hash of the presentation: renamed songs still match, changed
+    ones are converted locally. Every slide is checked against its SHA-256 when unpacked.
+    """
+    VERSION = 1
+    INDEX = "bundle.json"
+    DATE_TIME = (1980, 1, 1, 0, 0, 0)  # fixed, so exporting the same slides gives the same archive
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = Lock()
+        self._stat = None
+        self._entries = {}
+
+    def _load_index(self):
+        # Read again whenever the archive changed, e.g. pulled while the app is running
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            self._stat = None
+            self._entries = {}
+            return self._entries
+        if (stat.st_size, stat.st_mtime_ns) == self._stat:
+            return self._entries
+
+        self._stat = (stat.st_size, stat.st_mtime_ns)
+        self._entries = {}
+        try:
+            with zipfile.ZipFile(self.path) as bundle:
+                index = json.loads(bundle.read(self.INDEX))
+            if index.get("version") == self.VERSION:
+                self._entries = index["entries"]
+            else:
+                print(f"Cache bundle {self.path} has version {index.get('version')}, expected {self.VERSION}. Ignoring it")
+        except Exception as e:
+            print("Error during cache bundle loading: {}".format(e))
+        return self._entries
+
+    def has_render_key(self, render_key):
+        with self._lock:
+            return bool(self._load_index().get(render_key))
+
+    def find(self, content_hash, render_key):
+        with self._lock:
+            return self._load_index().get(render_key, {}).get(content_hash)
+
+    def extract(self, entry, image_path_bare):
+        """Unpacks the slides of an entry next to image_path_bare like a conversion would. Returns their paths"""
+        paths = []
+        with zipfile.ZipFile(self.path) as bundle:
+            for number, (name, sha) in enumerate(zip(entry["images"], entry["sha256"])):
+                data = bundle.read(name)
+                if hashlib.sha256(data).hexdigest() != sha:
+                    raise ValueError(f"{name} in the cache bundle is corrupt")
+                path = f"{image_path_bare}-{number}.{name.rsplit('.', 1)[1]}"
+                with open(path + ".tmp", "wb") as f:
+                    f.write(data)
+                os.replace(path + ".tmp", path)
+                paths.append(path)
+        return paths
+
+    @classmethod
+    def export(cls, path, songs):
+        """
+        Writes a bundle of songs given as (content hash, render key, image paths, renderers, tempo). Songs with the same
+        content are stored once. Returns the number of slides written
+        """
+        entries = {}
+        files = {}
+        for content_hash, render_key, images, renderers, tempo in songs:
+            if content_hash in entries.get(render_key, {}):
+                continue
+            names = [f"{render_key}/{content_hash}/{number}.{image.rsplit('.', 1)[1]}" for number, image in enumerate(images)]
+            files.update(zip(names, images))
+            entries.setdefault(render_key, {})[content_hash] = {
+                "slides": len(names),
+                "images": names,
+                "renderers": renderers,
+                "tempo": tempo,
+            }
+
+        # One slide at a time, the index goes last once all hashes are known
+        hashes = {}
+        tmp_path = path + ".tmp"
+        with zipfile.ZipFile(tmp_path, "w", zipfile.ZIP_DEFLATED) as bundle:
+            for name in sorted(files):
+                data = RawSlide.to_bytes(files[name])
+                hashes[name] = hashlib.sha256(data).hexdigest()
+                bundle.writestr(zipfile.ZipInfo(name, cls.DATE_TIME), data, zipfile.ZIP_DEFLATED)
+            for render_entries in entries.values():
+                for entry in render_entries.values():
+                    entry["sha256"] = [hashes[name] for name in entry["images"]]
+            index = json.dumps({"version": cls.VERSION, "entries": entries}, indent=1, sort_keys=True)
+            bundle.writestr(zipfile.ZipInfo(cls.INDEX, cls.DATE_TIME), index, zipfile.ZIP_DEFLATED)
+        os.replace(tmp_path, path)
+        return len(files)
+
+
+def parse_tempo(text):
+    """Tempo of a song as {"bpm": 120} or {"seconds_per_slide": 40}, None if text is not a tempo"""
+    match = TEMPO_PATTERN.fullmatch((text or "").strip())
+    if match is None or float(match.group(1).replace(",", ".")) <= 0:
+        return None
+    value = float(match.group(1).replace(",", "."))
+    return {"bpm": value} if match.group(2).lower() == "bpm" else {"seconds_per_slide": value}
+
+
+def find_tempo_tag(text):
+    """
+    Tempo of the first tag like "[120 bpm]" or "tempo: 40s" in free text, e.g. the keywords of a presentation.
+    Without the tag "80s ballad" would be a tempo
+    """
+    for match in TEMPO_TAG_PATTERN.finditer(text or ""):
+        tempo = parse_tempo(match.group(1) or match.group(2))
+        if tempo is not None:
+            return tempo
+    return None
+
+
+def split_song_name(name):
+    """(sequence, artist, song) of a name like `<sequence> - <artist> - <song>`, None if it is not named like that"""
+    parts = name.split("-")
+    if len(parts) < 3:
+        return None
+    return tuple(part.strip() for part in parts[:3])
+
+
+def split_song_tempo(name):
+    """Song name without a trailing tempo tag like "Creep [92 bpm]", and the tempo of the tag"""
+    match = re.search(r"\s*\[([^\]]*)\]\s*$", name)
+    tempo = parse_tempo(match.group(1)) if match is not None else None
+    if tempo is None:
+        return name, None
+    return name[:match.start()], tempo
+
+
+def get_render_key(render_size, encoding, native):
+    # Converted slides are only valid for the resolution, encoding and renderer they were rendered with
+    return f"{render_size[0]}x{render_size[1]}-{encoding}" + ("-native" if native else "")
+
+
+def slide_name_bare(filename_bare, content_hash, render_key):
+    # Loose slides are named after what they were rendered from, so converting a presentation again never overwrites
+    # the slides its manifest entry still points to. Followed by -<slide number>.<extension>
+    return f"{filename_bare}-{content_hash[:12]}-{render_key}"
+
+
+def slide_fingerprints(presentation, slides):
+    """
+    Per slide a hash of everything it is rendered from: its XML, the parts it refers to (layout, master, theme,
+    pictures, ...) and the slide size. Part names are left out, so an unchanged slide keeps its fingerprint when
+    slides are inserted or removed before it
+    """
+    from pptx.opc.constants import RELATIONSHIP_TYPE
+
+    part_hashes = {}
+
+    def _part_hash(part):
+        if part not in part_hashes:
+            part_hashes[part] = hashlib.sha256(part.blob).hexdigest()
+        return part_hashes[part]
+
+    fingerprints = []
+    for slide in slides:
+        sha = hashlib.sha256(f"{presentation.slide_width}x{presentation.slide_height}".encode())
+        sha.update(_part_hash(slide.part).encode())
+        related = set()
+        to_visit = [slide.part]
+        seen = {slide.part}
+        while to_visit:
+            part = to_visit.pop()
+            for rel in part.rels.values():
+                # Notes are not shown, and refer back to the slide
+                if rel.is_external or rel.reltype == RELATIONSHIP_TYPE.NOTES_SLIDE or rel.target_part in seen:
+                    continue
+                seen.add(rel.target_part)
+                related.add(_part_hash(rel.target_part))
+                to_visit.append(rel.target_part)
+        for part_hash in sorted(related):
+            sha.update(part_hash.encode())
+        fingerprints.append(sha.hexdigest())
+    return fingerprints
+
+
+def get_fitting_dpi(page_size_pts, render_size):
+    # Page size is given in points (1/72 inch). Pick the dpi where the page fills the render size
+    page_width, page_height = page_size_pts
+    scale = min(render_size[0] / page_width, render_size[1] / page_height)
+    return 72 * scale
+
+
+def rasterize_pages(pdf_path, dpi, pages, threads=1):
+    """
+    Yields (page number, image) in page order. Pages are rendered one by one, so at most `threads` pages are held
+    in memory no matter how many slides the presentation has
+    """
+    from pdf2image import convert_from_path
+
+    file_name = os.path.splitext(os.path.basename(pdf_path))[0]
+
+    def _render(page):
+        with timings.span("rasterize", file=file_name, page=page):
+            return convert_from_path(pdf_path, dpi=dpi, first_page=page, last_page=page)[0]
+
+    if threads <= 1:
+        for page in pages:
+            yield page, _render(page)
+        return
+
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        pending = deque()
+        for page in pages:
+            pending.append((page, pool.submit(_render, page)))
+            if len(pending) >= threads:
+                done_page, future = pending.popleft()
+                yield done_page, future.result()
+        while pending:
+            done_page, future = pending.popleft()
+            yield done_page, future.result()
+
+
+class RawSlide:
+    """
+    Converted slides are stored as raw pixels, rows bottom up as OpenGL expects them. Loading is a memory map and a
+    single texture upload, nothing has to be decoded. `colorfmt` and `pixels` go straight into Texture.blit_buffer.
+    """
+    HEADER = struct.Struct("<4sIIB3x")  # magic, width, height, channels
+    MAGIC = b"TPSL"
+    EXTENSION = "slide"
+    COLORFMTS = {1: "luminance", 3: "rgb"}
+
+    def __init__(self, path):
+        with open(path, "rb") as f:
+            # Copy on write: kivy wants a writable buffer, but as nothing writes, no page is ever copied
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY)
+        if len(self._mmap) < self.HEADER.size:
+            self._mmap.close()
+            raise ValueError(f"{path} is not a converted slide")
+        magic, width, height, channels = self.HEADER.unpack_from(self._mmap)
+        truncated = len(self._mmap) < self.HEADER.size + width * height * channels
+        if magic != self.MAGIC or channels not in self.COLORFMTS or truncated:
+            self._mmap.close()
+            raise ValueError(f"{path} is not a converted slide")
+        self.size = (width, height)
+        self.colorfmt = self.COLORFMTS[channels]
+        self.pixels = memoryview(self._mmap)[self.HEADER.size:self.HEADER.size + width * height * channels]
+
+    def page_in(self):
+        # Read every memory page, so the texture upload on the main thread does not wait for the SD card
+        self._mmap.madvise(mmap.MADV_WILLNEED)
+        for offset in range(0, len(self._mmap), mmap.PAGESIZE):
+            self._mmap[offset]
+
+    def close(self):
+        self.pixels.release()
+        self._mmap.close()
+
+    @classmethod
+    def to_bytes(cls, path):
+        """Contents of a slide file, also of a slide in a pack"""
+        if SlidePack.split(path) is None:
+            with open(path, "rb") as f:
+                return f.read()
+        slide = open_slide(path)
+        try:
+            channels = next(channels for channels, colorfmt in cls.COLORFMTS.items() if colorfmt == slide.colorfmt)
+            return cls.HEADER.pack(cls.MAGIC, slide.size[0], slide.size[1], channels) + bytes(slide.pixels)
+        finally:
+            slide.close()
+
+    @classmethod
+    def save(cls, image, image_path_bare, encoding):
+        """
+        Lyric slides are mostly text without colour. These are stored with one byte per pixel instead of three.
+        Returns the path of the saved slide.
+        """
+        rgb = image.convert("RGB")
+        grey = rgb.convert("L")
+        deviation = max(band_max for _, band_max in ImageChops.difference(rgb, grey.convert("RGB")).getextrema())
+        if encoding == "auto" and deviation <= SLIDE_GREYSCALE_TOLERANCE:
+            image = grey
+        else:
+            image = rgb
+
+        path = f"{image_path_bare}.{cls.EXTENSION}"
+        with timings.span("slide_save", file=os.path.basename(image_path_bare)):
+            # Replaced, not overwritten: the app may have the old slide memory mapped
+            with open(path + ".tmp", "wb") as f:
+                f.write(cls.HEADER.pack(cls.MAGIC, image.width, image.height, len(image.getbands())))
+                f.write(image.transpose(Image.Transpose.FLIP_TOP_BOTTOM).tobytes())
+            os.replace(path + ".tmp", path)
+        return path
+
+
+class ImageSlide:
+    """
+    Slide of an image folder song. Same interface as RawSlide, but the image is decoded when loaded. Images larger
+    than fit_size (e.g. photos) are scaled down to fit, at full size they would fill the texture cache
+    """
+    COLORFMTS = {"L": "luminance", "RGB": "rgb"}
+
+    def __init__(self, path, fit_size=None):
+        with Image.open(path) as image:
+            if fit_size is not None:
+                image.draft(None, fit_size)  # JPEGs are decoded at a fraction of their size right away
+            image = image.convert("L" if image.mode in ("1", "L", "LA", "I", "I;16") else "RGB")
+            if fit_size is not None:
+                image.thumbnail(fit_size)
+            self.size = image.size
+            self.colorfmt = self.COLORFMTS[image.mode]
+            self.pixels = image.transpose(Image.Transpose.FLIP_TOP_BOTTOM).tobytes()
+
+    def page_in(self):
+        pass
+
+    def close(self):
+        self.pixels = None
+
+
+class SlidePack:
+    """
+    Slides of a songbook in one file: a header, a JSON index of slide name to offset, width, height and channels,
+    then the pixels of every slide stored like in a RawSlide. A slide in a pack is addressed like a file inside it,
+    e.g. `010 - Practice/slides.pack/<name>.slide`. Every pack is memory mapped once and shared by its slides.
+    """
+    HEADER = struct.Struct("<4sII")  # magic, version, length of the index
+    MAGIC = b"TPPK"
+    VERSION = 1
+    FILE_NAME = "slides.pack"
+    _packs = {}
+    _packs_lock = Lock()
+
+    def __init__(self, path):
+        with open(path, "rb") as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY)
+        magic, version, index_length = self.HEADER.unpack_from(self._mmap)
+        if magic != self.MAGIC or version != self.VERSION:
+            self._mmap.close()
+            raise ValueError(f"{path} is not a slide pack of version {self.VERSION}")
+        self.data_start = self.HEADER.size + index_length
+        self.index = json.loads(self._mmap[self.HEADER.size:self.data_start])
+
+    @classmethod
+    def split(cls, path):
+        """(pack path, slide name) of a slide in a pack, None for any other path"""
+        marker = os.sep + cls.FILE_NAME + os.sep
+        position = path.rfind(marker)
+        if position < 0:
+            return None
+        return path[:position + len(marker) - 1], path[position + len(marker):]
+
+    @classmethod
+    def get(cls, path, reload=False):
+        with cls._packs_lock:
+            pack = cls._packs.get(path)
+            if pack is None or reload:
+                # An older mapping is closed once the last of its slides is gone
+                pack = cls._packs[path] = cls(path)
+            return pack
+
+    @classmethod
+    def open_slide(cls, path):
+        pack_path, name = cls.split(path)
+        pack = cls.get(pack_path)
+        if name not in pack.index:
+            # Packed again since it was mapped, e.g. by prebuild.py while the app is running
+            pack = cls.get(pack_path, reload=True)
+        if name not in pack.index:
+            raise FileNotFoundError(f"{name} is not in {pack_path}")
+        return PackedSlide(pack._mmap, pack.data_start, *pack.index[name])
+
+    @classmethod
+    def write(cls, path, slides):
+        """Packs slides given as name -> slide path, loose or in a pack (also this one, it is replaced atomically)"""
+        opened = []
+        try:
+            index = {}
+            offset = 0
+            for name, source in sorted(slides.items()):
+                slide = open_slide(source)
+                opened.append(slide)
+                channels = len(slide.pixels) // (slide.size[0] * slide.size[1])
+                index[name] = [offset, slide.size[0], slide.size[1], channels]
+                offset = offset + len(slide.pixels)
+
+            index_bytes = json.dumps(index).encode()
+            tmp_path = path + ".tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(cls.HEADER.pack(cls.MAGIC, cls.VERSION, len(index_bytes)))
+                f.write(index_bytes)
+                for slide in opened:
+                    f.write(slide.pixels)
+            os.replace(tmp_path, path)
+        finally:
+            for slide in opened:
+                slide.close()
+        with cls._packs_lock:
+            cls._packs.pop(path, None)
+
+
+class PackedSlide:
+    """Slide in a SlidePack. Same interface as RawSlide, the pixels are a view into the mapped pack"""
+
+    def __init__(self, pack_mmap, data_start, offset, width, height, channels):
+        self.size = (width, height)
+        self.colorfmt = RawSlide.COLORFMTS[channels]
+        start = data_start + offset
+        self.pixels = memoryview(pack_mmap)[start:start + width * height * channels]
+
+    def page_in(self):
+        # Only the pages of this slide, not the whole pack
+        for offset in range(0, len(self.pixels), mmap.PAGESIZE):
+            self.pixels[offset]
+
+    def close(self):
+        self.pixels.release()
+
+
+def slide_exists(path):
+    packed = SlidePack.split(path)
+    if packed is None:
+        return os.path.exists(path)
+    try:
+        return packed[1] in SlidePack.get(packed[0]).index or packed[1] in SlidePack.get(packed[0], reload=True).index
+    except (OSError, ValueError):
+        return False
+
+
+def open_slide(path, fit_size=None):
+    """fit_size only applies to images of image folder songs, converted slides have the right size already"""
+    if SlidePack.split(path) is not None:
+        return SlidePack.open_slide(path)
+    if path.endswith(f".{RawSlide.EXTENSION}"):
+        return RawSlide(path)
+    return ImageSlide(path, fit_size)
+
+
+def _uno_properties(**values):
+    from com.sun.star.beans import PropertyValue
+
+    properties = []
+    for name, value in values.items():
+        property_value = PropertyValue()
+        property_value.Name = name
+        property_value.Value = value
+        properties.append(property_value)
+    return tuple(properties)
+
+
+class OfficeService:
+    """
+    One LibreOffice converting presentations to PDF. With UNO it keeps running and converts one presentation after the
+    other over a pipe, without UNO soffice is started for every presentation. A conversion that takes longer than
+    SOFFICE_TIMEOUT or a LibreOffice that died gets it killed, the next conversion starts a fresh one.
+    Used by one conversion worker at a time, see OfficePool
+    """
+
+    def __init__(self):
+        self.work_dir = tempfile.mkdtemp(prefix="teleprompter-office-")
+        # Needs LibreOffice's Python bridge (python3-uno)
+        self.persistent = SOFFICE_PERSISTENT and importlib.util.find_spec("uno") is not None
+        self._pipe_name = os.path.basename(self.work_dir)
+        self._process = None
+        self._desktop = None
+
+    def _command(self):
+        return shlex.split(SOFFICE_COMMAND) + [
+            f"-env:UserInstallation=file://{os.path.join(self.work_dir, 'profile')}",
+            "--headless",
+        ]
+
+    def _start(self):
+        import uno
+        from com.sun.star.connection import NoConnectException
+
+        self._process = subprocess.Popen(
+            self._command() + [
+                "--invisible", "--nologo", "--norestore", "--nodefault", "--nolockcheck",
+                f"--accept=pipe,name={self._pipe_name};urp;StarOffice.ComponentContext",
+            ],
+            start_new_session=True  # its own process group, killed as a whole
+        )
+        local_context = uno.getComponentContext()
+        resolver = local_context.ServiceManager.createInstanceWithContext("com.sun.star.bridge.UnoUrlResolver", local_context)
+        deadline = time.monotonic() + SOFFICE_START_TIMEOUT
+        while True:
+            try:
+                context = resolver.resolve(f"uno:pipe,name={self._pipe_name};urp;StarOffice.ComponentContext")
+                break
+            except NoConnectException:
+                if self._process.poll() is not None:
+                    code = self._process.returncode
+                    self.stop(broken=True)
+                    raise Exception(f"LibreOffice exited with {code} while starting")
+                if time.monotonic() > deadline:
+                    self.stop(broken=True)
+                    raise Exception(f"LibreOffice did not start within {SOFFICE_START_TIMEOUT}s")
+                time.sleep(0.1)
+        self._desktop = context.ServiceManager.createInstanceWithContext("com.sun.star.frame.Desktop", context)
+
+    def _convert_uno(self, path, pdf_path):
+        import uno
+
+        document = self._desktop.loadComponentFromURL(
+            uno.systemPathToFileUrl(path), "_blank", 0, _uno_properties(Hidden=True, ReadOnly=True)
+        )
+        if document is None:
+            raise Exception("LibreOffice could not open the presentation")
+        try:
+            document.storeToURL(uno.systemPathToFileUrl(pdf_path), _uno_properties(FilterName="impress_pdf_Export"))
+        finally:
+            document.close(True)
+
+    def convert(self, path, output_dir):
+        """Converts the presentation into a PDF in output_dir and returns its path"""
+        pdf_path = os.path.join(output_dir, os.path.splitext(os.path.basename(path))[0] + ".pdf")
+        # A PDF left by an earlier conversion that failed later must not pass for this one
+        if os.path.exists(pdf_path):
+            os.unlink(pdf_path)
+        if not self.persistent:
+            process = subprocess.Popen(
+                self._command() + ["--convert-to", "pdf", "--outdir", output_dir, path],
+                start_new_session=True
+            )
+            try:
+                process.wait(SOFFICE_TIMEOUT)
+            except subprocess.TimeoutExpired:
+                self._kill(process)
+                shutil.rmtree(os.path.join(self.work_dir, "profile"), ignore_errors=True)
+                raise Exception(f"LibreOffice did not finish within {SOFFICE_TIMEOUT}s")
+            if process.returncode != 0:
+                raise Exception(f"LibreOffice exited with {process.returncode}")
+        else:
+            if self._process is not None and self._process.poll() is not None:
+                print("Error in LibreOffice: exited with {}, restarting".format(self._process.returncode))
+                self.stop(broken=True)
+            if self._process is None:
+                with timings.span("soffice_start"):
+                    self._start()
+
+            # UNO calls cannot time out, a helper thread waits for them
+            errors = []
+
+            def _run():
+                try:
+                    self._convert_uno(path, pdf_path)
+                except Exception as e:
+                    errors.append(e)
+
+            thread = Thread(target=_run, daemon=True)
+            thread.start()
+            thread.join(SOFFICE_TIMEOUT)
+            if thread.is_alive():
+                # Killing LibreOffice ends the call in the helper thread as well
+                self.stop(broken=True)
+                raise Exception(f"LibreOffice did not finish within {SOFFICE_TIMEOUT}s, restarted")
+            if errors:
+                if self._process.poll() is not None:
+                    self.stop(broken=True)
+                    raise Exception(f"LibreOffice crashed: {errors[0]}")
+                raise errors[0]
+
+        if not os.path.exists(pdf_path):
+            raise Exception("LibreOffice did not write a PDF")
+        return pdf_path
+
+    @staticmethod
+    def _kill(process):
+        try:
+            os.killpg(process.pid, signal.SIGTERM)
+            try:
+                process.wait(5)
+            except subprocess.TimeoutExpired:
+                os.killpg(process.pid, signal.SIGKILL)
+                process.wait()
+        except ProcessLookupError:
+            process.wait()
+
+    def stop(self, broken=False):
+        """broken throws away the profile as well, a killed LibreOffice may have left it half written"""
+        if self._process is not None:
+            self._desktop = None
+            self._kill(self._process)
+            self._process = None
+        if broken:
+            shutil.rmtree(os.path.join(self.work_dir, "profile"), ignore_errors=True)
+
+    def close(self):
+        self.stop()
+        shutil.rmtree(self.work_dir, ignore_errors=True)
+
+
+class OfficePool:
+    """
+    LibreOffice services shared by the conversion workers, one per conversion running at the same time. They are
+    reused for the whole session and stopped after SOFFICE_IDLE_TIMEOUT without conversions, or on exit
+    """
+
+    def __init__(self):
+        self._lock = Lock()
+        self._services = []
+        self._idle = []
+        self._idle_timer = None
+        atexit.register(self.close)
+
+    def convert(self, path, output_dir):
+        with self._lock:
+            if self._idle:
+                service = self._idle.pop()
+            else:
+                service = OfficeService()
+                self._services.append(service)
+        try:
+            return service.convert(path, output_dir)
+        finally:
+            with self._lock:
+                self._idle.append(service)
+                if self._idle_timer is not None:
+                    self._idle_timer.cancel()
+                self._idle_timer = Timer(SOFFICE_IDLE_TIMEOUT, self._stop_idle)
+                self._idle_timer.daemon = True
+                self._idle_timer.start()
+
+    def _stop_idle(self):
+        with self._lock:
+            if len(self._idle) < len(self._services):
+                return  # a conversion is running, its end restarts the timer
+            services = self._services
+            self._services = []
+            self._idle = []
+        for service in services:
+            service.close()
+
+    def close(self):
+        with self._lock:
+            if self._idle_timer is not None:
+                self._idle_timer.cancel()
+            services = self._services
+            self._services = []
+            self._idle = []
+        for service in services:
+            service.close()
+
+
+class ConversionQueue:
+    """
+    Converts songs on a pool of background workers. Waiting songs are handed out by priority: the focused song
+    first, then the rest of the focused songbook, then everything else in songbook/song order.
+    """
+
+    def __init__(self, convert, on_done, on_idle, workers):
+        self._convert = convert  # convert(song, work_dir) -> images
+        self._on_done = on_done  # on_done(song, images, error), called from the worker thread
+        self._on_idle = on_idle  # called from the last worker once nothing is left to convert
+        self._workers_max = workers
+        self._workers_running = 0
+        self.workers_busy = 0
+        self._lock = Lock()
+        self._heap = []
+        self._order = 0
+        self._focused_songbook = None
+        self._focused_song = None
+
+    def _priority(self, song):
+        if song["path"] == self._focused_song:
+            rank = 0
+        elif song["songbook_folder"] == self._focused_songbook:
+            rank = 1
+        else:
+            rank = 2
+        return rank
+
+    def add(self, song):
+        with self._lock:
+            heapq.heappush(self._heap, (self._priority(song), self._order, song))
+            self._order = self._order + 1
+            while self._workers_running < self._workers_max and self._workers_running < len(self._heap):
+                self._workers_running = self._workers_running + 1
+                Thread(target=self._work, daemon=True).start()
+
+    def remove(self, song_paths):
+        with self._lock:
+            self._heap = [item for item in self._heap if item[2]["path"] not in song_paths]
+            heapq.heapify(self._heap)
+
+    def set_focus(self, songbook_folder, song_path=None):
+        with self._lock:
+            if (songbook_folder, song_path) == (self._focused_songbook, self._focused_song):
+                return
+            self._focused_songbook = songbook_folder
+            self._focused_song = song_path
+            self._heap = [(self._priority(song), order, song) for _, order, song in self._heap]
+            heapq.heapify(self._heap)
+
+    def _work(self):
+        # Every worker gets its own output folder, the PDFs of two conversions would collide in the same folder.
+        # LibreOffice profiles belong to OfficeService
+        work_dir = tempfile.mkdtemp(prefix="teleprompter-")
+        os.makedirs(os.path.join(work_dir, "output"))
+        try:
+            while True:
+                with self._lock:
+                    if not self._heap:
+                        self._workers_running = self._workers_running - 1
+                        is_last = self._workers_running == 0
+                        break
+                    _, _, song = heapq.heappop(self._heap)
+                    self.workers_busy = self.workers_busy + 1
+
+                try:
+                    images = self._convert(song, work_dir)
+                    self._on_done(song, images, None)
+                except Exception as e:
+                    self._on_done(song, None, e)
+                finally:
+                    with self._lock:
+                        self.workers_busy = self.workers_busy - 1
+        finally:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+        if is_last:
+            self._on_idle()
+
+
+class SongbookConverter:
+    """
+    Finds songbooks and songs in the songbooks folder and converts presentations into slides fitting render_size.
+    Progress messages go to on_message, errors are printed.
+    """
+
+    def __init__(self, songbooks_path, render_size=None, on_message=None):
+        self.songbooks_path = songbooks_path
+        self.converted_path = os.path.join(songbooks_path, TEMP_FOLDER)
+        self.manifest = ConversionManifest(os.path.join(self.converted_path, MANIFEST_FILE), songbooks_path)
+        self.bundle = CacheBundle(os.path.join(songbooks_path, CACHE_BUNDLE_FILE))
+        self.office = OfficePool()
+        self.on_message = on_message or (lambda message: None)
+        self._app_lock = None  # see hold_app_lock
+        self.render_size = None
+        self.render_key = None
+        if render_size is not None:
+            self.set_render_size(render_size)
+
+    def hold_app_lock(self):
+        """Marks the app as running until the process exits, see app_running"""
+        os.makedirs(self.converted_path, exist_ok=True)
+        self._app_lock = open(os.path.join(self.converted_path, APP_LOCK_FILE), "a")
+        fcntl.flock(self._app_lock, fcntl.LOCK_SH)
+
+    def app_running(self):
+        try:
+            with open(os.path.join(self.converted_path, APP_LOCK_FILE), "a") as f:
+                fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return True
+        return False
+
+    def set_render_size(self, render_size):
+        self.render_size = tuple(render_size)
+        self.render_key = get_render_key(self.render_size, SLIDE_ENCODING, NATIVE_RENDERER)
+
+    def is_songbook_folder(self, songbook_folder):
+        songbook_path = os.path.join(self.songbooks_path, songbook_folder)
+        return os.path.isdir(songbook_path) and songbook_folder != TEMP_FOLDER and "-" in songbook_folder
+
+    def is_song_file(self, f):
+        return not f.startswith("~") and not f.startswith(".~lock") and f.lower().endswith(SONG_EXTENSIONS)
+
+    def is_song_folder(self, songbook_path, f):
+        # Named like a song. Only listed once it has images, but watched before so that images copied in are noticed
+        return not f.startswith(".") and split_song_name(f) is not None and os.path.isdir(os.path.join(songbook_path, f))
+
+    @staticmethod
+    def folder_images(path):
+        # Slides of an image folder song in file name order
+        return [
+            os.path.join(path, f) for f in sorted(os.listdir(path))
+            if not f.startswith(".") and f.lower().endswith(IMAGE_EXTENSIONS)
+        ]
+
+    def load_songbooks(self):
+        """
+        Songbooks with their songs, in folder order. Only the cache is looked at, songs that still need a
+        conversion are in state converting
+        """
+
+        with timings.span("scan"):
+            return self._load_songbooks()
+
+    def _load_songbooks(self):
+
+        # Get candidates
+        potential_songbooks = []
+        for songbook_folder in sorted(os.listdir(self.songbooks_path)):
+            if self.is_songbook_folder(songbook_folder):
+                potential_songbooks.append(os.path.join(self.songbooks_path, songbook_folder))
+
+        songbooks = []
+        for songbook_index, songbook_path in enumerate(potential_songbooks):
+            songbook_folder = os.path.basename(songbook_path)
+            songbook_sequence = songbook_folder.split("-")[0].strip()
+            songbook_title = songbook_folder.split("-")[1].strip()
+
+            # Collect songs for this songbook
+            songs = []
+            for f in sorted(os.listdir(songbook_path)):
+                path = os.path.join(songbook_path, f)
+                is_folder = os.path.isdir(path)
+                if f.startswith(".") or not (is_folder or self.is_song_file(f)):
+                    continue
+                name = split_song_name(f if is_folder else os.path.splitext(f)[0])
+                if name is None:
+                    print(f"Skipped {path}, songs are named <sequence> - <artist> - <song>")
+                    continue
+
+                if not is_folder:
+                    try:
+                        images = self.manifest.lookup(path, self.render_key)
+                    except Exception as e:
+                        print("Error during cache lookup: {}".format(e))
+                        images = None
+                    # Slides in the cache bundle are unpacked by the conversion workers, not while scanning
+                    state = "ready" if images is not None else "converting"
+                else:
+                    # Nothing to convert, the images are shown as they are
+                    images = self.folder_images(path)
+                    if not images:
+                        continue
+                    state = "ready"
+
+                sequence, artist, song = name
+                song, tempo = split_song_tempo(song)
+                if tempo is None and state == "ready" and os.path.isfile(path):
+                    tempo = (self.manifest.get(path) or {}).get("tempo")
+                songs.append({
+                    "sequence": sequence,
+                    "artist": artist,
+                    "song": song,
+                    "path": path,
+                    "songbook_folder": songbook_folder,
+                    "songbook_title": songbook_title,
+                    "images": images or [],
+                    "state": state,
+                    "tempo": tempo,  # the prompt scrolls by itself if set
+                })
+
+            # Collect songbooks
+            songbooks.append({
+                "sequence": songbook_sequence,
+                "title": songbook_title,
+                "folder": songbook_folder,
+                "songs": songs,
+                "index": songbook_index
+            })
+        return songbooks
+
+    def import_from_bundle(self, path):
+        """Slides of the presentation unpacked from the cache bundle, None if the bundle does not have them"""
+        if not self.bundle.has_render_key(self.render_key):
+            return None
+        stat = os.stat(path)
+        content_hash = self.manifest.content_hash(path)
+        entry = self.bundle.find(content_hash, self.render_key)
+        if entry is None:
+            return None
+
+        songbook_folder = os.path.basename(os.path.dirname(path))
+        filename_bare = os.path.splitext(os.path.basename(path))[0]
+        converted_path = os.path.join(self.converted_path, songbook_folder)
+        os.makedirs(converted_path, exist_ok=True)
+        with timings.span("bundle_import", file=filename_bare):
+            images = self.bundle.extract(
+                entry, os.path.join(converted_path, slide_name_bare(filename_bare, content_hash, self.render_key))
+            )
+        self.manifest.store(path, stat, content_hash, self.render_key, images, entry["renderers"], tempo=entry.get("tempo"))
+        return images
+
+    def export_bundle(self, songs, path=None):
+        """Packs the converted slides of songs into the cache bundle. Returns the number of songs and of slides"""
+        exported = []
+        for song in songs:
+            if not os.path.isfile(song["path"]):
+                # Image folder songs need no conversion
+                continue
+            images = self.manifest.lookup(song["path"], self.render_key)
+            if images is not None:
+                entry = self.manifest.get(song["path"])
+                exported.append((entry["hash"], self.render_key, images, entry["renderers"], entry.get("tempo")))
+        slides = CacheBundle.export(path or self.bundle.path, exported)
+        return len(exported), slides
+
+    @staticmethod
+    def song_label(song):
+        return f"{song['songbook_title']}: {song['artist']} - {song['song']}"
+
+    def convert_song(self, song, work_dir, workers_busy=1):
+        """Converts the song in a conversion worker. workers_busy is the number of conversions running right now"""
+        with timings.span("convert", file=os.path.splitext(os.path.basename(song["path"]))[0]):
+            # Unpacking from the cache bundle is much faster than converting
+            try:
+                images = self.import_from_bundle(song["path"])
+            except Exception as e:
+                print("Error during cache bundle import: {}".format(e))
+                images = None
+            if images is not None:
+                self.on_message(f"{self.song_label(song)} (from the cache bundle)")
+                return images
+            return self.presentation_to_images(
+                song["path"],
+                song["songbook_folder"],
+                self.song_label(song),
+                work_dir,
+                workers_busy
+            )
+
+    def presentation_to_pdf(self, path_to_presentation, work_dir):
+        # convert pptx to PDF
+        with timings.span("soffice", file=os.path.splitext(os.path.basename(path_to_presentation))[0]):
+            return self.office.convert(path_to_presentation, os.path.join(work_dir, "output"))
+
+    def presentation_to_images(self, path_to_presentation, songbook_name, label, work_dir, workers_busy=1):
+        from pdf2image import pdfinfo_from_path
+        from pptx import Presentation
+
+        from pptx_renderer import PresentationRenderer, UnsupportedSlide
+
+        converted_path = os.path.join(self.converted_path, songbook_name)
+        os.makedirs(converted_path, exist_ok=True)
+
+        filename_bare, extension = os.path.splitext(os.path.basename(path_to_presentation))
+        is_pdf = extension.lower() == ".pdf"  # goes straight to rasterizing
+
+        stat = os.stat(path_to_presentation)
+        content_hash = ConversionManifest.content_hash(path_to_presentation)
+        image_path_bare = os.path.join(converted_path, slide_name_bare(filename_bare, content_hash, self.render_key))
+
+        created_image_paths = {}  # by slide number
+        renderers = {}
+        reused = {}  # by slide number, slides that did not change since the last conversion
+        slides_num = None
+        fingerprints = None
+        tempo = None
+        if not is_pdf:
+            try:
+                with timings.span("pptx_parse", file=filename_bare):
+                    presentation = Presentation(path_to_presentation)
+                    # LibreOffice does not export hidden slides either
+                    slides = [slide for slide in presentation.slides if slide._element.get("show") != "0"]
+                    fingerprints = slide_fingerprints(presentation, slides)
+                    properties = presentation.core_properties
+                    tempo = find_tempo_tag(" ".join(
+                        text for text in (properties.keywords, properties.subject, properties.comments) if text
+                    ))
+                slides_num = len(slides)
+
+                reusable = self.manifest.reusable_slides(path_to_presentation, self.render_key)
+                for number, fingerprint in enumerate(fingerprints):
+                    if fingerprint in reusable:
+                        reused[number] = reusable[fingerprint]
+                if reused:
+                    print(f"{label}: {len(reused)} of {slides_num} slides did not change")
+                    # Used where they are, the new slides get names of their own
+                    created_image_paths = {number: path for number, (path, _) in reused.items()}
+                    renderers = {number: renderer for number, (_, renderer) in reused.items()}
+            except Exception as e:
+                print("Error during reading of {}: {}".format(path_to_presentation, e))
+                slides_num = None
+                fingerprints = None
+                created_image_paths = {}
+                renderers = {}
+
+        # Text only slides are rendered directly, only the others need LibreOffice
+        if NATIVE_RENDERER and slides_num is not None and len(created_image_paths) < slides_num:
+            try:
+                renderer = PresentationRenderer(presentation, self.render_size)
+                for number, slide in enumerate(slides):
+                    if number in created_image_paths:
+                        continue
+                    try:
+                        with timings.span("native_render", file=filename_bare, page=number + 1):
+                            img = renderer.render(slide)
+                    except UnsupportedSlide as e:
+                        print(f"{label}: slide {number + 1} needs LibreOffice ({e})")
+                        continue
+                    im_name = RawSlide.save(img, f"{image_path_bare}-{number}", SLIDE_ENCODING)
+                    created_image_paths[number] = im_name
+                    renderers[number] = "native"
+                    img.close()
+            except Exception as e:
+                print("Error during native rendering of {}: {}".format(path_to_presentation, e))
+
+        if slides_num is None or len(created_image_paths) < slides_num:
+            pdffile_name = path_to_presentation if is_pdf else self.presentation_to_pdf(path_to_presentation, work_dir)
+            pdf_info = pdfinfo_from_path(pdffile_name)
+            if is_pdf:
+                tempo = find_tempo_tag(" ".join(str(pdf_info.get(field, "")) for field in ("Keywords", "Subject")))
+            page_size = pdf_info["Page size"].split()
+            dpi = get_fitting_dpi((float(page_size[0]), float(page_size[2])), self.render_size)
+
+            # Never mix slides and pages if they do not match up
+            if pdf_info["Pages"] != slides_num:
+                created_image_paths = {}
+                renderers = {}
+                fingerprints = None
+
+            # Use the cores that other conversions leave free
+            threads = RASTERIZE_THREADS or max(1, (os.cpu_count() or 1) - workers_busy + 1)
+
+            # Render and save page by page, only the pages that are missing
+            pages = [page for page in range(1, pdf_info["Pages"] + 1) if page - 1 not in created_image_paths]
+            for page, img in rasterize_pages(pdffile_name, dpi, pages, threads):
+                im_name = RawSlide.save(img, f"{image_path_bare}-{page - 1}", SLIDE_ENCODING)
+                created_image_paths[page - 1] = im_name
+                renderers[page - 1] = "pdf" if is_pdf else "soffice"
+                img.close()
+
+            if not is_pdf:
+                os.unlink(pdffile_name)
+
+        if not created_image_paths:
+            # Nothing to show, the prompt needs at least one slide
+            raise Exception("no slides, the presentation is empty or all its slides are hidden")
+
+        numbers = sorted(created_image_paths)
+        renderers = [renderers[number] for number in numbers]
+        created_image_paths = [created_image_paths[number] for number in numbers]
+
+        self.manifest.store(
+            path_to_presentation, stat, content_hash, self.render_key, created_image_paths, renderers, fingerprints, tempo
+        )
+        native_num = renderers.count("native")
+        if native_num == len(renderers):
+            self.on_message(f"{label} (converted without LibreOffice)")
+        elif native_num > 0:
+            self.on_message(f"{label} (converted, {native_num}/{len(renderers)} slides without LibreOffice)")
+        else:
+            self.on_message(f"{label} (converted)")
+
+        return created_image_paths
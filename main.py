@@ -1,29 +1,57 @@
-import os
-import subprocess
-from threading import Thread
+import time
+
+STARTED = time.perf_counter()  # before importing anything else, the time to the first frame includes the imports
 
-from evdev import InputDevice, list_devices, categorize
+import json
+import os
+import queue
+from collections import OrderedDict, deque
+from threading import Lock, Thread
 
 from kivy.app import App
 from kivy.core.window import Window
-from kivy.properties import ObjectProperty, StringProperty, BooleanProperty
+from kivy.graphics import Color, PopMatrix, PushMatrix, Rectangle, Translate
+from kivy.graphics.texture import Texture
+from kivy.properties import ObjectProperty, StringProperty, BooleanProperty, NumericProperty
 from kivy.uix.boxlayout import BoxLayout
 from kivy.uix.floatlayout import FloatLayout
-from kivy.uix.gridlayout import GridLayout
+from kivy.uix.recycleview import RecycleView
+from kivy.uix.recycleview.views import RecycleDataViewBehavior
 from kivy.uix.label import Label
+from kivy.uix.stencilview import StencilView
 from kivy.clock import Clock
 
-from pdf2image import convert_from_bytes
-from pptx import Presentation
+from converter import CONVERSION_WORKERS, IMAGE_EXTENSIONS, ConversionQueue, SongbookConverter, find_songbooks_path, open_slide
+from sync import SyncFollower, SyncLeader
+from timing import timings
+from watcher import Inotify, IN_ATTRIB, IN_CLOSE_WRITE, IN_CREATE, IN_DELETE, IN_ISDIR, IN_MOVED_FROM, IN_MOVED_TO
 
 FOOT_SWITCH_DEVICE_NAME_SUFFIX = "FootSwitch Keyboard"
 FOOT_SWITCH_DEVICE_A_KEY = "KEY_A"
 FOOT_SWITCH_DEVICE_B_KEY = "KEY_B"
 FOOT_SWITCH_DEVICE_C_KEY = "KEY_C"
-SONGBOOK_MIN_ROWS_NUM = 3
+FOOT_SWITCH_INPUT_PATH = "/dev/input"  # watched for the foot switch being plugged in or reconnecting
+HOLD_REPEAT_RATE = 4  # actions per second while a pedal or key is held down, 0 ignores holding
+SONGBOOK_MIN_ROWS_NUM = 3  # rows of songs on screen, more songs scroll
 SONGBOOK_MIN_COLS_NUM = 6
-SONGBOOKS_FOLDER = "songbooks"  # by default one folder up from code folder  otherwise within code folder
-TEMP_FOLDER = "#converted#"  # inside SONGBOOKS_FOLDER
+LOADING_SCREEN_LINES = 25  # most recent messages shown on the loading screen
+LOADING_SCREEN_REFRESH_RATE = 10  # loading screen updates per second
+AUTO_SCROLL = True  # songs with a tempo scroll by themselves in the prompt instead of turning pages
+AUTO_SCROLL_BEATS_PER_SLIDE = 32  # for tempos in bpm, a slide scrolls by in 8 bars of 4/4
+AUTO_SCROLL_NUDGE = 0.25  # slides a press on A or C scrolls back or ahead
+AUTO_SCROLL_SPEED_STEP = 0.05  # speed change per hold repeat of A or C
+AUTO_SCROLL_FPS = 60  # refresh rate of the screen, longer frames count as dropped
+TEXTURE_CACHE_MB = 64  # GPU memory for slides preloaded around the current one
+TIMING_REPORT = "timings.json"  # inside the converted folder, written once loading finished and on exit. Empty disables timing
+HOT_RELOAD = True  # pick up changes in the songbooks folder while running
+HOT_RELOAD_DEBOUNCE = 2  # seconds without further changes before songbooks are reloaded
+SYNC_ROLE = os.environ.get("TELEPROMPTER_SYNC", "")  # leader or follower keeps prompters on the same slide, empty for one
+SYNC_ADDRESS = os.environ.get("TELEPROMPTER_SYNC_ADDRESS", "<broadcast>")  # followers of the leader, 127.0.0.1 for one machine
+SYNC_PORT = 47474
+SYNC_RESEND_INTERVAL = 0.25  # seconds, followers catch up this fast after a lost packet
+SYNC_SCROLL_TOLERANCE = 0.05  # slides a follower's auto scroll may be off before it is moved
+SONGBOOKS_WATCH_MASK = IN_CREATE | IN_DELETE | IN_MOVED_FROM | IN_MOVED_TO
+SONGBOOK_WATCH_MASK = IN_CREATE | IN_CLOSE_WRITE | IN_DELETE | IN_MOVED_FROM | IN_MOVED_TO  # also image folder songs
 
 # SIZES
 TOP_BAR_TO_IMAGE_RATIO = 0.04
@@ -31,21 +59,45 @@ BOTTOM_BAR_TO_IMAGE_RATIO = 0.04
 
 
 class LoadingScreenLayout(BoxLayout):
-    previous_text = ""
+    """
+    Tail of the loading log and the conversion progress. Any thread can post, lines go into a ring buffer that is
+    drawn at a fixed rate. So posting stays cheap no matter how many messages a large library produces
+    """
+    loading_screen_text = StringProperty("Loading ...")
+    progress_done = NumericProperty(0)
+    progress_total = NumericProperty(0)
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self._lines = deque([self.loading_screen_text], maxlen=LOADING_SCREEN_LINES)
+        self._progress = (0, 0)
+        self._lock = Lock()
+        self._changed = False
+        Clock.schedule_interval(self._draw, 1 / LOADING_SCREEN_REFRESH_RATE)
 
     def draw_text(self, text, append=False):
-        
-        if append:
-            all = self.previous_text.split("\n")
-            if len(all) > 0:
-                all[-1] = all[-1] + text
+        with self._lock:
+            if append and self._lines:
+                self._lines[-1] = self._lines[-1] + text
             else:
-                all.append(text)
-            self.loading_screen_text = "\n".join(all)
-            self.previous_text = "\n".join(all)
-        else:
-            self.loading_screen_text = self.previous_text + "\n" + text
-            self.previous_text = self.previous_text + "\n" + text
+                self._lines.extend(text.split("\n"))
+            self._changed = True
+
+    def set_progress(self, done, total):
+        with self._lock:
+            self._progress = (done, total)
+            self._changed = True
+
+    def _draw(self, dt):
+        with self._lock:
+            if not self._changed:
+                return
+            self._changed = False
+            text = "\n".join(self._lines)
+            done, total = self._progress
+        self.loading_screen_text = text
+        self.progress_total = total
+        self.progress_done = done
 
 
 class HomeLayout(BoxLayout):
@@ -55,6 +107,7 @@ class HomeLayout(BoxLayout):
 class Songbook(BoxLayout):
     focus = ObjectProperty()
     index = ObjectProperty()
+    folder = StringProperty()
     sequence = StringProperty()
     title = StringProperty()
     songs = ObjectProperty()
@@ -70,37 +123,57 @@ class BackButton(
     focus = ObjectProperty()
 
 
-class SongList(GridLayout):
-    pass
-
+class SongList(RecycleView):
+    """
+    Only the songs on screen have a widget, these are reused while scrolling. So a songbook with hundreds of songs
+    opens as fast as a small one
+    """
 
-class Song(
-    BoxLayout,
-):
-    focus = ObjectProperty()
-    is_placeholder = BooleanProperty()
-    sequence = ObjectProperty()
-    artist = ObjectProperty()
-    song = ObjectProperty()
-
-    def __init__(
-        self,
-        sequence=None,
-        artist=None,
-        song=None,
-        index=None,
-        is_placeholder=False,
-        images=None,
-        **kwargs,
-    ):
-        super().__init__(**kwargs)
-        self.focus = False
-        self.index = index
-        self.is_placeholder = is_placeholder
-        self.images = images
-        self.sequence = str(index + 1)  # I decided to do my own counting and not show the users sequence identifier
-        self.artist = artist
-        self.song = song
+    @staticmethod
+    def song_data(index, song, focus=False):
+        return {
+            "index": index,
+            "sequence": str(index + 1),  # I decided to do my own counting and not show the users sequence identifier
+            "artist": song["artist"],
+            "song": song["song"],
+            "state": song["state"],
+            "focus": focus,
+        }
+
+    def update_song(self, index, **values):
+        # Changes the data without refreshing every view, only the song's widget if it is on screen
+        self.data[index].update(values)
+        view = self.view_adapter.get_visible_view(index)
+        if view is not None:
+            for name, value in values.items():
+                setattr(view, name, value)
+
+    def scroll_to_index(self, index):
+        # Scroll just as far as needed to have the song's row on screen
+        # The layout's height is only updated in the next frame when the data was just swapped, so compute it
+        layout = self.layout_manager
+        row_height = layout.default_size[1] + layout.spacing[1]
+        rows = -(-len(self.data) // layout.cols)
+        scrollable = layout.padding[1] + layout.padding[3] + rows * row_height - layout.spacing[1] - self.height
+        if scrollable <= 0:
+            return
+        row_top = layout.padding[1] + index // layout.cols * row_height
+        row_bottom = row_top + layout.default_size[1]
+        top = (1 - self.scroll_y) * scrollable  # distance of the visible part from the top
+        if row_top < top:
+            top = row_top - layout.padding[1]
+        elif row_bottom > top + self.height:
+            top = row_bottom + layout.padding[3] - self.height
+        self.scroll_y = 1 - min(max(top / scrollable, 0), 1)
+
+
+class Song(RecycleDataViewBehavior, BoxLayout):
+    focus = BooleanProperty(False)
+    index = NumericProperty(0)
+    sequence = StringProperty()
+    artist = StringProperty()
+    song = StringProperty()
+    state = StringProperty("ready")  # converting, ready or failed
 
 
 class SequenceLabel(Label):
@@ -115,62 +188,398 @@ class SongLabel(Label):
     pass
 
 
+class SlideTextureCache:
+    """
+    Slide textures uploaded ahead of time, so a page turn only has to bind a texture. Least recently used textures
+    are dropped once the memory budget is exceeded, except the pinned ones around the current slide.
+    Slides are mapped and paged in by a background worker, the kivy thread only does the upload.
+    """
+    BYTES_PER_PIXEL = {"luminance": 1, "luminance_alpha": 2, "rgb": 3, "bgr": 3}
+
+    def __init__(self, budget_bytes):
+        self.budget_bytes = budget_bytes
+        self.fit_size = None  # images of image folder songs are scaled down to fit the slide size
+        self._textures = OrderedDict()
+        self._textures_bytes = 0
+        self._loading = set()
+        self._pinned = set()
+        self._to_load = queue.Queue()
+        Thread(target=self._load_worker, daemon=True).start()
+
+    @staticmethod
+    def _to_texture(slide):
+        # Must be called from the kivy thread
+        texture = Texture.create(size=slide.size, colorfmt=slide.colorfmt)
+        texture.blit_buffer(slide.pixels, colorfmt=slide.colorfmt, bufferfmt="ubyte")
+        return texture
+
+    def _texture_bytes(self, texture):
+        return texture.width * texture.height * self.BYTES_PER_PIXEL.get(texture.colorfmt, 4)
+
+    def _add(self, source, texture):
+        if source in self._textures:
+            return
+        self._textures[source] = texture
+        self._textures_bytes = self._textures_bytes + self._texture_bytes(texture)
+
+        # Evict least recently used
+        for old_source in list(self._textures):
+            if self._textures_bytes <= self.budget_bytes:
+                break
+            if old_source in self._pinned:
+                continue
+            old_texture = self._textures.pop(old_source)
+            self._textures_bytes = self._textures_bytes - self._texture_bytes(old_texture)
+
+    def get(self, source):
+        """Texture of the source, loaded synchronously if it was not preloaded"""
+        texture = self._textures.get(source)
+        if texture is not None:
+            self._textures.move_to_end(source)
+            return texture
+
+        try:
+            slide = open_slide(source, self.fit_size)
+        except (OSError, ValueError) as e:
+            # Missing or broken, e.g. pruned while showing. Not cached, so it is tried again next time
+            print("Error during slide loading: {}".format(e))
+            return self._empty_texture()
+        try:
+            texture = self._to_texture(slide)
+        finally:
+            slide.close()
+        self._add(source, texture)
+        return texture
+
+    @staticmethod
+    def _empty_texture():
+        texture = Texture.create(size=(1, 1), colorfmt="luminance")
+        texture.blit_buffer(b"\0", colorfmt="luminance", bufferfmt="ubyte")
+        return texture
+
+    def forget(self, sources):
+        """Drops textures of slides that were converted again, the same path may now hold another slide"""
+        for source in sources:
+            texture = self._textures.pop(source, None)
+            if texture is not None:
+                self._textures_bytes = self._textures_bytes - self._texture_bytes(texture)
+
+    def prefetch(self, sources):
+        """Load sources in the background. These are kept even if the budget is exceeded until the next prefetch"""
+        self._pinned = set(sources)
+        for source in sources:
+            if source in self._textures:
+                self._textures.move_to_end(source)
+            elif source not in self._loading:
+                self._loading.add(source)
+                self._to_load.put(source)
+
+    def _load_worker(self):
+        while True:
+            source = self._to_load.get()
+            try:
+                slide = open_slide(source, self.fit_size)
+                slide.page_in()
+            except Exception as e:
+                print("Error during slide preloading: {}".format(e))
+                Clock.schedule_once(lambda dt, source=source: self._loading.discard(source))
+                continue
+
+            # Textures can only be created in the kivy thread
+            Clock.schedule_once(lambda dt, source=source, slide=slide: self._on_prefetched(source, slide))
+
+    def _on_prefetched(self, source, slide):
+        self._loading.discard(source)
+        try:
+            if source not in self._textures:
+                self._add(source, self._to_texture(slide))
+        finally:
+            slide.close()
+
+
+class ScrollStrip(StencilView):
+    """
+    The slides of a song one below the other, scrolling continuously. A frame only changes a translation on the GPU,
+    the slides in view are drawn by two rectangles whose textures are swapped when a slide leaves the view.
+    Positions are in slides, so a resize does not lose the place.
+    """
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.sources = []
+        self.position = 0  # slides scrolled past the top of the first one
+        self.slides_per_second = 0
+        self.paused = True
+        self.label = ""
+        self.on_change = None  # called when the slide at the top changes or scrolling pauses or resumes
+        self._texture_cache = None
+        self._first = None
+        self._frame_event = None
+        self._last_frame = None
+        self._reset_frame_stats()
+        with self.canvas:
+            Color(1, 1, 1, 1)
+            PushMatrix()
+            self._translate = Translate(0, 0)
+            self._rectangles = [Rectangle(size=(0, 0)) for _ in range(2)]
+            PopMatrix()
+        self.bind(pos=self._update_slides, size=self._update_slides)
+
+    @property
+    def end(self):
+        return max(0, len(self.sources) - 1)
+
+    @property
+    def slide_number(self):
+        return min(int(self.position), self.end)
+
+    def load(self, sources, texture_cache, slide_number=0, label=""):
+        self.pause()
+        self.sources = sources
+        self.label = label
+        self._texture_cache = texture_cache
+        self.position = min(slide_number, self.end)
+        self._reset_frame_stats()
+        self._update_slides()
+
+    def clear(self):
+        self.pause()
+        self.sources = []
+        self._update_slides()
+
+    def resume(self):
+        if not self.paused or self.position >= self.end:
+            return
+        self.paused = False
+        self._last_frame = time.perf_counter()
+        self._frame_event = Clock.schedule_interval(self._on_frame, 0)
+        if self.on_change:
+            self.on_change()
+
+    def pause(self):
+        if self.paused:
+            return
+        self.paused = True
+        self._frame_event.cancel()
+        self._frame_event = None
+        self._record_frame_stats()
+        if self.on_change:
+            self.on_change()
+
+    def nudge(self, slides):
+        self.position = min(max(self.position + slides, 0), self.end)
+        self._move()
+
+    def frame_stats(self):
+        """Frames drawn while scrolling the current song, how many were dropped and the longest frame"""
+        return {
+            "frames": self._frames,
+            "dropped": self._dropped,
+            "worst_frame_ms": round(self._worst_frame * 1000, 1),
+        }
+
+    def _reset_frame_stats(self):
+        self._frames = 0
+        self._dropped = 0
+        self._worst_frame = 0
+        self._scrolled = 0  # seconds
+        self._recorded = (0, 0, 0)
+
+    def _record_frame_stats(self):
+        # Per scrolled stretch, from one pause to the next
+        frames, dropped, scrolled = (
+            self._frames - self._recorded[0], self._dropped - self._recorded[1], self._scrolled - self._recorded[2]
+        )
+        if frames:
+            timings.record(
+                "auto_scroll", scrolled, song=self.label, frames=frames, dropped=dropped,
+                worst_frame_ms=round(self._worst_frame * 1000, 1)
+            )
+        self._recorded = (self._frames, self._dropped, self._scrolled)
+
+    def _on_frame(self, dt):
+        now = time.perf_counter()
+        frame = now - self._last_frame
+        self._last_frame = now
+        self._frames = self._frames + 1
+        self._scrolled = self._scrolled + frame
+        self._worst_frame = max(self._worst_frame, frame)
+        if frame > 1.5 / AUTO_SCROLL_FPS:
+            self._dropped = self._dropped + round(frame * AUTO_SCROLL_FPS) - 1
+
+        self.position = min(self.position + self.slides_per_second * frame, self.end)
+        self._move()
+        if self.position >= self.end:
+            self.pause()
+
+    def _move(self):
+        self._translate.y = self.position * self.height
+        if self.slide_number != self._first:
+            self._update_slides()
+
+    def _update_slides(self, *args):
+        # Rectangles are placed in strip coordinates, only the translation follows the scrolling
+        self._first = self.slide_number
+        for i, rectangle in enumerate(self._rectangles):
+            number = self._first + i
+            if number >= len(self.sources) or not self.width or not self.height:
+                rectangle.texture = None
+                rectangle.size = (0, 0)
+                continue
+            texture = self._texture_cache.get(self.sources[number])
+            scale = min(self.width / texture.width, self.height / texture.height)
+            width, height = texture.width * scale, texture.height * scale
+            rectangle.texture = texture
+            rectangle.size = (width, height)
+            rectangle.pos = (self.x + (self.width - width) / 2, self.top - (number + 1) * self.height + (self.height - height) / 2)
+        self._translate.y = self.position * self.height
+        if self.sources:
+            self._texture_cache.prefetch(self.sources[self._first:self._first + 3])
+        if self.on_change:
+            self.on_change()
+
+
 class PromptLayout(BoxLayout):
     current_image_number = ObjectProperty(0)
     current_image_source = ObjectProperty()
+    current_texture = ObjectProperty(None, allownone=True)
     number_of_slides = ObjectProperty()
     
-    current_song = ObjectProperty()
+    current_song = ObjectProperty()  # song dicts
+    current_song_index = NumericProperty(0)
     next_song = ObjectProperty()
     
     all_songs = ObjectProperty()
-    placeholders_num = ObjectProperty()
 
-    def load(self, current_song):
+    scroll_strip = ObjectProperty()
+    scrolling = BooleanProperty(False)  # auto scroll instead of page turns
+    scroll_status = StringProperty("")
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self._texture_cache = SlideTextureCache(TEXTURE_CACHE_MB * 1024 * 1024)
+        self._scroll_speed = 1  # relative to the song's tempo
+
+    def load(self, song_index, image_number=0):
         
         # Prepare first draw
-        self.current_song = current_song
-        self.images = current_song.images
-        self.number_of_slides = len(current_song.images)
-        self.current_image_number = 0
-        self.current_image_source = self.images[0]
+        self.current_song_index = song_index
+        self.current_song = self.all_songs[song_index]
+        self.images = self.current_song["images"]
+        self.number_of_slides = len(self.images)
         self.next_song = self.get_next_song()
+
+        seconds_per_slide = self.get_seconds_per_slide(self.current_song)
+        self.scrolling = seconds_per_slide is not None
+        if self.scrolling:
+            # Starts paused, the performer starts it with the song
+            self._scroll_speed = 1
+            self.scroll_strip.on_change = self._on_scroll_change
+            self.scroll_strip.load(self.images, self._texture_cache, image_number, self.current_song["song"])
+            self.scroll_strip.slides_per_second = 1 / seconds_per_slide
+            self._on_scroll_change()
+        else:
+            self.scroll_strip.clear()
+            self.show_image(image_number)
+
+    @staticmethod
+    def get_seconds_per_slide(song):
+        tempo = song.get("tempo")
+        if not AUTO_SCROLL or not tempo:
+            return None
+        if "bpm" in tempo:
+            return AUTO_SCROLL_BEATS_PER_SLIDE * 60 / tempo["bpm"]
+        return tempo["seconds_per_slide"]
+
+    def toggle_scroll(self):
+        if self.scroll_strip.paused:
+            self.scroll_strip.resume()
+        else:
+            self.scroll_strip.pause()
+
+    def change_scroll_speed(self, steps):
+        self._scroll_speed = min(max(self._scroll_speed * (1 + AUTO_SCROLL_SPEED_STEP) ** steps, 0.25), 4)
+        self.scroll_strip.slides_per_second = self._scroll_speed / self.get_seconds_per_slide(self.current_song)
+        self._on_scroll_change()
+
+    def stop_scroll(self):
+        self.scroll_strip.pause()
+
+    def _on_scroll_change(self):
+        self.current_image_number = self.scroll_strip.slide_number
+        status = f"Auto {round(self._scroll_speed * 100)}%"
+        if self.scroll_strip.paused:
+            # Not while scrolling, a changing label costs frames
+            dropped = self.scroll_strip.frame_stats()["dropped"]
+            status = status + ", paused" + (f", {dropped} dropped frames" if dropped else "")
+        self.scroll_status = status
+
+    def forget_slides(self, sources):
+        self._texture_cache.forget(sources)
+
+    def set_slide_size(self, size):
+        self._texture_cache.fit_size = size
+
+    def show_image(self, image_number):
+        self.current_image_number = image_number
+        self.current_image_source = self.images[image_number]
+        self.current_texture = self._texture_cache.get(self.current_image_source)
+
+        # Preload whatever the next page turn can bring
+        sources = []
+        if image_number + 1 < self.number_of_slides:
+            sources.append(self.images[image_number + 1])
+        if image_number > 0:
+            sources.append(self.images[image_number - 1])
+        else:
+            previous_song = self.get_previous_song()
+            if previous_song["state"] == "ready" and previous_song["images"]:
+                sources.append(previous_song["images"][-1])
+        if self.next_song["state"] == "ready" and self.next_song["images"]:
+            sources.append(self.next_song["images"][0])
+        self._texture_cache.prefetch(sources)
     
     def get_previous_song(self):
-        next_index = self.current_song.index - 1
-        if next_index < 0:
-            next_index = len(self.all_songs) - 1 - self.placeholders_num
-        for song in self.all_songs:
-            if song.index == next_index:
-                return song
-        return None
+        return self.all_songs[(self.current_song_index - 1) % len(self.all_songs)]
 
     def get_next_song(self):
-        next_index = self.current_song.index + 1
-        if next_index >= len(self.all_songs) - self.placeholders_num:
-            next_index = 0
-        for song in self.all_songs:
-            if song.index == next_index:
-                return song
-        return None
+        return self.all_songs[(self.current_song_index + 1) % len(self.all_songs)]
     
-    def prev_image(self):
+    def prev_image(self, input_time=None):
+        if self.scrolling and self.scroll_strip.position > 0:
+            self.scroll_strip.nudge(-AUTO_SCROLL_NUDGE)
+            return
         if self.current_image_number - 1 < 0:
             to_load = self.get_previous_song()
-            self.load(to_load)
-            self.current_image_number = self.number_of_slides - 1
-            self.current_image_source = self.images[self.current_image_number]
+            if to_load["state"] != "ready":
+                return
+            self.load((self.current_song_index - 1) % len(self.all_songs), len(to_load["images"]) - 1)
         else:
-            self.current_image_number = self.current_image_number - 1
-            self.current_image_source = self.images[self.current_image_number]
+            self.show_image(self.current_image_number - 1)
+        self._measure_page_turn(input_time)
 
-    def next_image(self):
+    def next_image(self, input_time=None):
+        if self.scrolling and self.scroll_strip.position < self.scroll_strip.end:
+            self.scroll_strip.nudge(AUTO_SCROLL_NUDGE)
+            return
         if self.current_image_number + 1 > self.number_of_slides - 1:
             to_load = self.get_next_song()
-            self.load(to_load)
+            if to_load["state"] != "ready":
+                return
+            self.load((self.current_song_index + 1) % len(self.all_songs))
         else:
-            self.current_image_number = self.current_image_number + 1
-            self.current_image_source = self.images[self.current_image_number]
+            self.show_image(self.current_image_number + 1)
+        self._measure_page_turn(input_time)
+
+    def _measure_page_turn(self, input_time):
+        # From the input event (time.time() based like evdev timestamps) until the frame with the new slide is flipped
+        if not timings.enabled or input_time is None:
+            return
+
+        def _on_flip(*args):
+            Window.unbind(on_flip=_on_flip)
+            timings.record("page_turn", time.time() - input_time)
+        Window.bind(on_flip=_on_flip)
 
 
 class PrompterTopBar(BoxLayout):
@@ -186,18 +595,31 @@ class TeleprompterWidget(FloatLayout):
     mode = StringProperty("loading")  # Expose to template
     current_songbook = ObjectProperty()
     focused_songbook = ObjectProperty()
-    focused_song = ObjectProperty()
+    focused_song = ObjectProperty(None, allownone=True)  # song dict
 
     def __init__(self, **kwargs):
         super().__init__(**kwargs)
 
-        self._input_state = None
-        self._song_instances = None
-        self._placeholders_num = 0
-
-        # Check for Foot Switch and connect
-        self._fs_device = self._find_foot_switch_device()
-        Thread(target=self._detect_foot_switch_events, daemon=True).start()
+        self._started = time.perf_counter()
+        timings.enabled = bool(TIMING_REPORT)
+        self._songs_total = 0
+        self._songs_done = 0
+        # Input from the foot switch thread and the keyboard, handled in order once per frame
+        self._input_queue = deque()
+        self._input_lock = Lock()
+        self._process_input_trigger = Clock.create_trigger(self._process_input)
+        self._last_action_time = {}  # by button, timestamp of the input that last triggered an action
+        self._keyboard_buttons_down = set()
+        self._ignore_hold = set()  # buttons whose hold left a screen, ignored until released
+        self._timing_startup_pending = True
+        self._timing_report_spans = 0
+        self._songs = []  # of the open songbook
+        self._focused_song_index = None
+        self._songbook_states = {}  # by folder
+
+        # Look for the foot switch in the background and keep watching, it may be plugged in later or reconnect
+        Thread(target=self._watch_foot_switch, daemon=True).start()
+        Window.bind(on_flip=self._on_first_frame)
 
         # Connect Keyboard
         self._keyboard = Window.request_keyboard(self._keyboard_closed, self)
@@ -205,74 +627,156 @@ class TeleprompterWidget(FloatLayout):
             on_key_down=self._on_keyboard_down,
             on_key_up=self._on_keyboard_up,
         )
-        self._previous_keyboard_state = None
         
-        # Define location of songbooks folder
-        potential_folder = os.path.join(os.path.dirname(os.path.dirname(os.path.realpath(__file__))), SONGBOOKS_FOLDER)
-        if os.path.exists(potential_folder):
-            self.songbooks_path = potential_folder
-            self.songbooks_converted_path = os.path.join(potential_folder, TEMP_FOLDER)
-        else:
-            potential_folder = os.path.join(os.path.dirname(os.path.realpath(__file__)), SONGBOOKS_FOLDER)
-            if os.path.exists(potential_folder):
-                self.songbooks_path = potential_folder
-                self.songbooks_converted_path = os.path.join(potential_folder, TEMP_FOLDER)
-            else:
-                raise Exception("Could not find a songbooks folder inside of code folder or one level up")
-        
-        # Create a thread to load songbooks and draw its contents
+        # Conversion in the background. Slides are rendered to exactly fit the image area of the prompt screen,
+        # the size is known once the window is up
+        self.songbooks_path = find_songbooks_path()
+        self._converter = SongbookConverter(self.songbooks_path, on_message=self.update_loading_screen)
+        try:
+            self._converter.hold_app_lock()
+        except OSError as e:
+            print("Error during app lock: {}".format(e))
+        self._manifest = self._converter.manifest
+        self._conversion_queue = ConversionQueue(
+            self._convert_song,
+            self._on_song_converted,
+            self._on_conversion_idle,
+            CONVERSION_WORKERS or os.cpu_count() or 1
+        )
+
+        # Songbooks rescanned while a song is being prompted are applied afterwards
+        self._pending_reload = None
+
+        self._sync_leader = None
+        self._sync_follower = None
+        self._sync_state = None  # last sent by the leader
+
+        # Create a thread to load songbooks and draw its contents. Wait one frame so that the window has its final size
         self.songbooks = []
-        Thread(target=self.load_and_draw).start()
+        Clock.schedule_once(lambda dt: self._start_loading())
+
+    def _start_loading(self):
+        render_size = (
+            int(Window.width),
+            int(Window.height * (1 - TOP_BAR_TO_IMAGE_RATIO - BOTTOM_BAR_TO_IMAGE_RATIO))
+        )
+        self._converter.set_render_size(render_size)
+        self._manifest.set_render_size(render_size)
+        self.ids["prompt_layout"].set_slide_size(render_size)
+        Thread(target=self.load_and_draw, daemon=True).start()
 
     """
     Setup UI
     """
 
-    def _find_foot_switch_device(self):
-        fs_device = None
-        devices = [InputDevice(path) for path in list_devices()]
+    def _on_first_frame(self, *args):
+        Window.unbind(on_flip=self._on_first_frame)
+        timings.record("startup_to_first_frame", time.perf_counter() - STARTED, STARTED)
 
-        for device in devices:
+    def _open_foot_switch(self, paths, others=None):
+        """Opens the first of the input devices that is the foot switch. Names of the other devices go into others"""
+        from evdev import InputDevice
+
+        for path in paths:
+            try:
+                device = InputDevice(path)
+            except OSError:
+                continue  # gone again, or udev did not set its permissions yet
             if device.name.endswith(FOOT_SWITCH_DEVICE_NAME_SUFFIX):
-                message = f"Found {FOOT_SWITCH_DEVICE_NAME_SUFFIX} at {device.path}"
-                self.update_loading_screen(message)
-                fs_device = device
-                break
-        if fs_device is None:
+                return device
+            if others is not None:
+                others.append(f"{device.path} {device.name}")
+            device.close()
+        return None
+
+    def _watch_foot_switch(self):
+        # Foot switch thread. evdev is only imported here, so it does not delay the first frame
+        started = time.perf_counter()
+        from evdev import KeyEvent, ecodes, list_devices
+
+        buttons = {
+            ecodes.ecodes[FOOT_SWITCH_DEVICE_A_KEY]: "A",
+            ecodes.ecodes[FOOT_SWITCH_DEVICE_B_KEY]: "B",
+            ecodes.ecodes[FOOT_SWITCH_DEVICE_C_KEY]: "C",
+        }
+        states = {KeyEvent.key_up: "up", KeyEvent.key_down: "down", KeyEvent.key_hold: "hold"}
+
+        # Start watching before looking so that a foot switch plugged in between is not missed
+        inotify = None
+        try:
+            inotify = Inotify()
+            inotify.add_watch(FOOT_SWITCH_INPUT_PATH, IN_CREATE | IN_ATTRIB)
+        except OSError as e:
+            print("Error while watching input devices, foot switch hotplug disabled: {}".format(e))
+            if inotify is not None:
+                inotify.close()
+            inotify = None
+
+        others = []
+        device = self._open_foot_switch(list_devices(FOOT_SWITCH_INPUT_PATH), others)
+        timings.record("foot_switch_discovery", time.perf_counter() - started, started)
+        if device is None:
             self.update_loading_screen(f"Did not find footswitch device called '{FOOT_SWITCH_DEVICE_NAME_SUFFIX}'")
-            self.update_loading_screen("Use keyboard instead")
-            if len(devices) > 0:
+            self.update_loading_screen("Use keyboard instead" + (", it is picked up once plugged in" if inotify else ""))
+            if others:
                 print("Found:")
-                for device in devices:
-                    print(device)
-        return fs_device
-
-    def _detect_foot_switch_events(self):
-        if self._fs_device:
-            with self._fs_device.grab_context():
-                for ev in self._fs_device.async_read_loop():
-                    btn = None
-                    state = None
-                    as_string = str(categorize(ev))
-                    if FOOT_SWITCH_DEVICE_A_KEY in as_string:
-                        btn = "A"
-                    elif FOOT_SWITCH_DEVICE_B_KEY in as_string:
-                        btn = "B"
-                    elif FOOT_SWITCH_DEVICE_C_KEY in as_string:
-                        btn = "C"
-
-                    if "up" in as_string:
-                        state = "up"
-                    elif "down" in as_string:
-                        state = "down"
-                    elif "hold" in as_string:
-                        state = "hold"
-
-                    if btn and state:
-                        self._input_state = (btn, state)
-                        
-                        # The foot switch detection is in a separate thread. Use Clock to get back into the kivy thread
-                        Clock.schedule_once(lambda dt: self._decide_action())
+                for other in others:
+                    print(other)
+
+        while True:
+            if device is None:
+                if inotify is None:
+                    return
+                # A new device node shows up before udev lets us open it, its permissions change (IN_ATTRIB) after
+                paths = sorted({
+                    os.path.join(path, name) for path, name, _ in inotify.read() if name.startswith("event")
+                })
+                device = self._open_foot_switch(paths)
+                if device is None:
+                    continue
+
+            self.update_loading_screen(f"Found {FOOT_SWITCH_DEVICE_NAME_SUFFIX} at {device.path}")
+            try:
+                with device.grab_context():
+                    for ev in device.read_loop():
+                        if ev.type == ecodes.EV_KEY and ev.code in buttons:
+                            self._queue_input(buttons[ev.code], states[ev.value], ev.timestamp())
+            except OSError as e:
+                # Unplugged, or grabbed by someone else
+                print("Error while reading the foot switch: {}".format(e))
+                self.update_loading_screen(f"Lost {FOOT_SWITCH_DEVICE_NAME_SUFFIX}, use keyboard until it is back")
+            try:
+                device.close()
+            except OSError:
+                pass
+            device = None
+
+    def _queue_input(self, btn, state, timestamp):
+        # Called from the foot switch thread as well. timestamp is wall clock like evdev's event timestamps
+        with self._input_lock:
+            self._input_queue.append((btn, state, timestamp))
+        self._process_input_trigger()
+
+    def _process_input(self, dt=None):
+        # Every queued event is taken exactly once. Only repeats of a held button are coalesced: within one batch
+        # the last repeat wins, and repeats are applied at most HOLD_REPEAT_RATE times per second
+        with self._input_lock:
+            events = list(self._input_queue)
+            self._input_queue.clear()
+
+        last_hold = {btn: i for i, (btn, state, _) in enumerate(events) if state == "hold"}
+        for i, (btn, state, timestamp) in enumerate(events):
+            if state == "up":
+                self._ignore_hold.discard(btn)
+                continue
+            if state == "hold":
+                if last_hold[btn] != i or not HOLD_REPEAT_RATE or btn in self._ignore_hold:
+                    continue
+                if timestamp - self._last_action_time.get(btn, 0) < 1 / HOLD_REPEAT_RATE:
+                    continue
+            self._last_action_time[btn] = timestamp
+            self._decide_action(btn, state, timestamp)
+            timings.record("input_to_action", time.time() - timestamp, btn=btn, state=state)
 
     def _keyboard_closed(self):
         # Do not unbind, otherwise escape from prompt will switch to home but then no keys are detected anymore
@@ -286,22 +790,13 @@ class TeleprompterWidget(FloatLayout):
         state = None
         if key == "1" or key == "numpad1":
             btn = "A"
-            if self._previous_keyboard_state == "down" + btn:
-                state = "hold"
-            else:
-                state = "down"
         if key == "2" or key == "numpad2":
             btn = "B"
-            if self._previous_keyboard_state == "down" + btn:
-                state = "hold"
-            else:
-                state = "down"
         if key == "3" or key == "numpad3":
             btn = "C"
-            if self._previous_keyboard_state == "down" + btn:
-                state = "hold"
-            else:
-                state = "down"
+        if btn:
+            # Key repeats while held
+            state = "hold" if btn in self._keyboard_buttons_down else "down"
         if key == "escape":
             # Stop listener
             if self.mode == "home":
@@ -321,340 +816,530 @@ class TeleprompterWidget(FloatLayout):
                 )
 
         if btn and state:
-            self._input_state = (btn, state)
-            self._previous_keyboard_state = state + btn
-            self._decide_action()
+            self._keyboard_buttons_down.add(btn)
+            self._queue_input(btn, state, time.time())
         return True
 
     def _on_keyboard_up(self, keyboard, keycode):
         key = keycode[1]
         btn = None
         state = None
-        if key == "1" or key == "numapd1":
+        if key == "1" or key == "numpad1":
             btn = "A"
             state = "up"
-        if key == "2" or key == "numapd2":
-            btn = "V"
+        if key == "2" or key == "numpad2":
+            btn = "B"
             state = "up"
-        if key == "3" or key == "numapd3":
+        if key == "3" or key == "numpad3":
             btn = "C"
             state = "up"
         if btn and state:
-            self._input_state = (btn, state)
-            # self._decide_action()
+            self._keyboard_buttons_down.discard(btn)
+            self._queue_input(btn, state, time.time())
         return True
 
-    def _decide_action(self):
-        if self._input_state:
-            if self.mode == "home":
-                if self._input_state[0] == "A" and self._input_state[1] in [
-                    "hold",
-                    "down",
-                ]:
-                    self.focus_previous_songbook()
-                if self._input_state[0] == "C" and self._input_state[1] in [
-                    "hold",
-                    "down",
-                ]:
-                    self.focus_next_songbook()
-
-                if self._input_state[0] == "B" and self._input_state[1] in [
-                    "hold",
-                    "down",
-                ]:
-                    self.songbook_open(self.focused_songbook)
-            elif self.mode == "songbook":
-                if self._input_state[0] == "A" and self._input_state[1] in [
-                    "hold",
-                    "down",
-                ]:
-                    self.focus_previous_song()
-                if self._input_state[0] == "C" and self._input_state[1] in [
-                    "hold",
-                    "down",
-                ]:
-                    self.focus_next_song()
-
-                if self._input_state[0] == "B" and self._input_state[1] in [
-                    "hold",
-                    "down",
-                ]:
-                    self.enter_prompt()
-            else:
-                if self._input_state[0] == "A" and self._input_state[1] in [
-                    "hold",
-                    "down",
-                ]:
-                    self.prompt_prev()
-                if self._input_state[0] == "C" and self._input_state[1] in [
-                    "hold",
-                    "down",
-                ]:
-                    self.prompt_next()
-
-                if self._input_state[0] == "B" and self._input_state[1] in [
-                    "hold",
-                    "down",
-                ]:
-                    self.set_mode("songbook")
+    def _decide_action(self, btn, state, timestamp):
+        if self.mode == "home":
+            if btn == "A" and state in ["hold", "down"]:
+                self.focus_previous_songbook()
+            if btn == "C" and state in ["hold", "down"]:
+                self.focus_next_songbook()
+
+            if btn == "B" and state in ["hold", "down"]:
+                self.songbook_open(self.focused_songbook)
+        elif self.mode == "songbook":
+            if btn == "A" and state in ["hold", "down"]:
+                self.focus_previous_song()
+            if btn == "C" and state in ["hold", "down"]:
+                self.focus_next_song()
+
+            if btn == "B" and state in ["hold", "down"]:
+                self.enter_prompt()
+        elif self.ids["prompt_layout"].scrolling:
+            # Press to nudge and pause, hold to change the speed or to leave
+            if btn == "A" and state == "down":
+                self.prompt_prev(timestamp)
+            if btn == "C" and state == "down":
+                self.prompt_next(timestamp)
+            if btn == "A" and state == "hold":
+                self.ids["prompt_layout"].change_scroll_speed(-1)
+            if btn == "C" and state == "hold":
+                self.ids["prompt_layout"].change_scroll_speed(1)
+
+            if btn == "B" and state == "down":
+                self.ids["prompt_layout"].toggle_scroll()
+            if btn == "B" and state == "hold":
+                self._ignore_hold.add(btn)
+                self.set_mode("songbook")
+        else:
+            if btn == "A" and state in ["hold", "down"]:
+                self.prompt_prev(timestamp)
+            if btn == "C" and state in ["hold", "down"]:
+                self.prompt_next(timestamp)
+
+            if btn == "B" and state in ["hold", "down"]:
+                self.set_mode("songbook")
+
+        if self._sync_leader is not None:
+            self._sync_publish()
 
     """
     Actions
     """
 
+    def _focus_song(self, index):
+        # Only the widget losing and the one getting focus change. None focuses the back button,
+        # focused_song then stays the song that was focused last
+        self.ids["back_button"].focus = index is None
+        if self._focused_song_index is not None:
+            self.ids["song_list"].update_song(self._focused_song_index, focus=False)
+        if index is not None:
+            self._focused_song_index = index
+            self.focused_song = self._songs[index]
+            self.ids["song_list"].update_song(index, focus=True)
+            self.ids["song_list"].scroll_to_index(index)
+
+            songbook_state = self._songbook_states[self.current_songbook.folder]
+            songbook_state["focused_index"] = index
+            songbook_state["scroll_y"] = self.ids["song_list"].scroll_y
+        self._update_conversion_focus()
+
+    def _focus_songbook(self, index):
+        self.focused_songbook.focus = False
+        self.focused_songbook = self.songbooks[index % len(self.songbooks)]
+        self.focused_songbook.focus = True
+        self._update_conversion_focus()
+
     def focus_previous_song(self):
-        
-        # Handle back button
+        # The back button sits between the last and the first song
         if self.ids["back_button"].focus is True:
-            next_index = len(self._song_instances) - 1 - self._placeholders_num
-            self.ids["back_button"].focus = False
+            next_index = len(self._songs) - 1
         else:
-            next_index = self.focused_song.index - 1    
-
-        if next_index < 0:
-            self.ids["back_button"].focus = True
-        for song in self._song_instances:
-            if song.index == next_index:
-                song.focus = True
-                self.focused_song = song
-            else:
-                song.focus = False
+            next_index = self._focused_song_index - 1
+        self._focus_song(next_index if next_index >= 0 else None)
 
     def focus_next_song(self):
-
-        # Handle back button
         if self.ids["back_button"].focus is True:
             next_index = 0
-            self.ids["back_button"].focus = False
         else:
-            next_index = self.focused_song.index + 1
-
-        if next_index >= len(self._song_instances) - self._placeholders_num:
-            self.ids["back_button"].focus = True
-        for song in self._song_instances:
-            if song.index == next_index:
-                song.focus = True
-                self.focused_song = song
-            else:
-                song.focus = False
+            next_index = self._focused_song_index + 1
+        self._focus_song(next_index if next_index < len(self._songs) else None)
 
     def focus_previous_songbook(self):
-        next_index = self.focused_songbook.index - 1
-        if next_index < 0:
-            next_index = len(self.songbooks) - 1
-        for songbook in self.songbooks:
-            if songbook.index == next_index:
-                songbook.focus = True
-                self.focused_songbook = songbook
-            else:
-                songbook.focus = False
+        self._focus_songbook(self.focused_songbook.index - 1)
 
     def focus_next_songbook(self):
-        next_index = self.focused_songbook.index + 1
-        if next_index >= len(self.songbooks):
-            next_index = 0
-        for songbook in self.songbooks:
-            if songbook.index == next_index:
-                songbook.focus = True
-                self.focused_songbook = songbook
-            else:
-                songbook.focus = False
+        self._focus_songbook(self.focused_songbook.index + 1)
 
     def enter_prompt(self):
         if self.ids["back_button"].focus is True:
             self.set_mode("home")
             return
-        
-        self.ids["prompt_layout"].load(self.focused_song)
+
+        # Slides of this song are not available (yet)
+        if self.focused_song is None or self.focused_song["state"] != "ready":
+            return
+
+        self.ids["prompt_layout"].load(self._focused_song_index)
         self.set_mode("prompt")
 
-    def prompt_prev(self):
-        self.ids["prompt_layout"].prev_image()
+    def prompt_prev(self, input_time=None):
+        self.ids["prompt_layout"].prev_image(input_time)
 
-    def prompt_next(self):
-        self.ids["prompt_layout"].next_image()
+    def prompt_next(self, input_time=None):
+        self.ids["prompt_layout"].next_image(input_time)
 
     def songbook_open(self, songbook):
         self.ids["back_button"].focus = False
+        self.current_songbook = songbook
         self.initialize_songbook(songbook)
         self.set_mode("songbook")
+        self._update_conversion_focus()
 
     def set_mode(self, mode):
         self.mode = mode
+        if mode != "prompt":
+            self.ids["prompt_layout"].stop_scroll()
+
+        if mode in ("home", "songbook") and self._pending_reload is not None:
+            songbook_dicts, self._pending_reload = self._pending_reload, None
+            self._apply_songbooks_reload(songbook_dicts)
 
     """
-    Load Song Books
+    Sync
     """
 
-    def _presentation_to_images(self, path_to_presentation, songbook_name):
-        IMAGE_FORMAT = "jpg"
-        
-        converted_path = os.path.join(self.songbooks_converted_path, songbook_name)
-        if not os.path.exists(converted_path):
-            os.makedirs(converted_path)
-
-        filename_bare = os.path.basename(path_to_presentation).replace(".pptx", "")
-
-        # Give cache if images are present but only if ppt is not newer
-        expected_image_paths = []
-        cache_ok = True
+    def _start_sync(self):
+        # Once the songbooks are shown
         try:
-            presentation = Presentation(path_to_presentation)
-            for i in range(len(presentation.slides)):
-                expected_image = os.path.join(
-                    converted_path, f"{filename_bare}-{i}.{IMAGE_FORMAT}"
-                )
-                expected_image_paths.append(expected_image)
-                if os.path.exists(expected_image) is False:
-                    cache_ok = False
-                else:
-                    if os.path.getmtime(expected_image) < os.path.getmtime(path_to_presentation):
-                        cache_ok = False
-        except Exception as e:
-            print("Error during presentation loading: {}".format(e))
-            cache_ok = False
+            if SYNC_ROLE == "leader":
+                self._sync_leader = SyncLeader(SYNC_ADDRESS, SYNC_PORT, self._on_sync_round_trip)
+                Clock.schedule_interval(lambda dt: self._sync_publish(resend=True), SYNC_RESEND_INTERVAL)
+            elif SYNC_ROLE == "follower":
+                self._sync_follower = SyncFollower(SYNC_PORT, self._on_sync_message)
+        except OSError as e:
+            print("Error during sync setup, prompting alone: {}".format(e))
+            return
+        if SYNC_ROLE:
+            self.update_loading_screen(f"Sync: {SYNC_ROLE} on port {SYNC_PORT}")
+
+    def _get_sync_state(self):
+        # Songs are identified by songbook folder and file name, the same on every prompter pulling the same songbooks
+        prompt_layout = self.ids["prompt_layout"]
+        state = {"mode": self.mode, "songbook": self.focused_songbook.folder if self.focused_songbook else None}
+        if self.mode == "songbook":
+            state["songbook"] = self.current_songbook.folder
+            state["song"] = None if self.ids["back_button"].focus else os.path.basename(self.focused_song["path"])
+        elif self.mode == "prompt":
+            state["songbook"] = prompt_layout.current_song["songbook_folder"]
+            state["song"] = os.path.basename(prompt_layout.current_song["path"])
+            state["slide"] = prompt_layout.current_image_number
+            if prompt_layout.scrolling:
+                strip = prompt_layout.scroll_strip
+                state["scroll"] = [round(strip.position, 3), strip.paused, strip.slides_per_second]
+        return state
+
+    def _sync_publish(self, resend=False):
+        if self.mode == "loading":
+            return
+        state = self._get_sync_state()
+        if not resend and state == self._sync_state:
+            return
+        self._sync_state = state
+        self._sync_leader.send(state, resend)
+
+    def _on_sync_round_trip(self, address, seconds):
+        timings.record("sync_round_trip", seconds, follower=address[0])
+
+    def _on_sync_message(self, message, address):
+        # From the follower's network thread
+        received = time.time()
+
+        def _apply(dt):
+            if self.mode == "loading":
+                return
+            try:
+                self._apply_sync_state(message["state"])
+            except Exception as e:
+                print("Error during sync of {}: {}".format(message["state"], e))
+                return
+            if not message["resend"]:
+                timings.record("sync_latency", time.time() - message["sent"], receive_to_shown=time.time() - received)
+            self._sync_follower.acknowledge(message, address)
+        Clock.schedule_once(_apply)
+
+    def _apply_sync_state(self, state):
+        # Only what differs is changed, most messages are repetitions
+        songbook = next((songbook for songbook in self.songbooks if songbook.folder == state["songbook"]), None)
+        if songbook is None:
+            return
+        if state["mode"] == "home":
+            if self.focused_songbook is not songbook:
+                self._focus_songbook(songbook.index)
+            if self.mode != "home":
+                self.set_mode("home")
+            return
 
-        if cache_ok:
-            self.update_loading_screen(" (cache)", append=True)
-            return expected_image_paths
+        if self.mode == "home" or self.current_songbook is not songbook:
+            self._focus_songbook(songbook.index)
+            self.songbook_open(songbook)
+        file_names = [os.path.basename(song["path"]) for song in self._songs]
+        index = file_names.index(state["song"]) if state["song"] in file_names else None
+        if state["mode"] == "songbook" or index is None or self._songs[index]["state"] != "ready":
+            # Also where a song of the leader is not converted here yet
+            if self.mode == "prompt":
+                self.set_mode("songbook")
+            if index != self._focused_song_index or self.ids["back_button"].focus != (index is None):
+                self._focus_song(index)
+            return
 
-        # convert pptx to PDF
-        command_list = ["soffice", "--headless", "--convert-to", "pdf", path_to_presentation]
-        subprocess.run(command_list)
+        prompt_layout = self.ids["prompt_layout"]
+        slide = min(state["slide"], len(self._songs[index]["images"]) - 1)
+        if self.mode != "prompt" or prompt_layout.current_song is not self._songs[index]:
+            self._focus_song(index)
+            prompt_layout.load(index, slide)
+            self.set_mode("prompt")
+        elif not prompt_layout.scrolling and prompt_layout.current_image_number != slide:
+            prompt_layout.show_image(slide)
+
+        if prompt_layout.scrolling and "scroll" in state:
+            position, paused, slides_per_second = state["scroll"]
+            strip = prompt_layout.scroll_strip
+            strip.slides_per_second = slides_per_second
+            if abs(strip.position - position) > SYNC_SCROLL_TOLERANCE:
+                strip.nudge(position - strip.position)
+            if paused:
+                strip.pause()
+            else:
+                strip.resume()
 
-        pdffile_name = filename_bare + ".pdf"
-        with open(pdffile_name, "rb") as f:
-            pdf_bytes = f.read()
-        images = convert_from_bytes(pdf_bytes, dpi=96 * 4)
+    """
+    Load Song Books
+    """
 
-        created_image_paths = []
-        for i, img in enumerate(images):
-            im_name = os.path.join(converted_path, f"{filename_bare}-{i}.{IMAGE_FORMAT}")
-            created_image_paths.append(im_name)
-            img.save(im_name)
+    def _convert_song(self, song, work_dir):
+        # Runs in a conversion worker
+        return self._converter.convert_song(song, work_dir, self._conversion_queue.workers_busy)
 
-        os.unlink(pdffile_name)
+    def _on_song_converted(self, song, images, error):
+        if error is None and self._manifest.changed_since_stored(song["path"]):
+            # Saved again while it was converting, these slides show the old version
+            self._conversion_queue.add(song)
+            return
+        if error is not None:
+            print("Error during conversion of {}: {}".format(song["path"], error))
+            self.update_loading_screen(f"{SongbookConverter.song_label(song)} (failed)")
+
+        # Conversion workers are separate threads. Use Clock to get back into the kivy thread
+        def _update(dt):
+            if song["state"] == "converting":
+                self._songs_done = self._songs_done + 1
+                self.ids["loading_screen"].set_progress(self._songs_done, self._songs_total)
+            song["images"] = images or []
+            song["state"] = "ready" if error is None else "failed"
+            if song.get("tempo") is None and error is None:
+                # Tempo from the presentation's metadata
+                song["tempo"] = (self._manifest.get(song["path"]) or {}).get("tempo")
+            self.ids["prompt_layout"].forget_slides(song["images"])
+            songbook_state = self._songbook_states.get(song["songbook_folder"])
+            for index, songbook_song in enumerate(songbook_state["songs"] if songbook_state else []):
+                if songbook_song is not song:
+                    continue
+                if songbook_state["songs"] is self._songs:
+                    self.ids["song_list"].update_song(index, state=song["state"])
+                else:
+                    songbook_state["data"][index]["state"] = song["state"]
+        Clock.schedule_once(_update)
+
+    def _on_conversion_idle(self):
+        # Called from the last conversion worker
+        self._manifest.save()
+        if timings.enabled and self._timing_startup_pending:
+            self._timing_startup_pending = False
+            timings.record("startup_to_converted", time.perf_counter() - self._started, self._started)
+            self.write_timing_report()
+
+    def write_timing_report(self):
+        # Nothing new since the last report
+        if not timings.enabled or len(timings) == self._timing_report_spans:
+            return
+        self._timing_report_spans = len(timings)
+        try:
+            timings.write(
+                os.path.join(self._converter.converted_path, TIMING_REPORT),
+                render_size=self._converter.render_size,
+            )
+        except Exception as e:
+            print("Error while writing timing report: {}".format(e))
+        print("\n".join(["Timings:"] + timings.summary()))
 
-        self.update_loading_screen(" (converted)", append=True)
+    def _show_last_timing_report(self):
+        # Compare with the previous start while this one is loading
+        try:
+            with open(os.path.join(self._converter.converted_path, TIMING_REPORT)) as f:
+                report = json.load(f)
+        except (OSError, ValueError):
+            return
+        self.update_loading_screen(f"\nLast start ({report['started']}):")
+        for name in ("startup_to_first_frame", "foot_switch_discovery", "scan", "startup_to_home", "startup_to_converted", "page_turn"):
+            stat = report["stats"].get(name)
+            if stat is not None:
+                self.update_loading_screen(
+                    f"{name}: {stat['total'] * 1000:.0f} ms" if stat["count"] == 1 else
+                    f"{name}: {stat['count']}x, median {stat['median'] * 1000:.0f} ms, max {stat['max'] * 1000:.0f} ms"
+                )
 
-        return created_image_paths
-    
-    def load_songbooks(self):
-        
-        # Get candidates
-        potential_songbooks = []
-        for songbook_folder in sorted(os.listdir(self.songbooks_path)):
-            songbook_path = os.path.join(self.songbooks_path, songbook_folder)
-            if os.path.isdir(songbook_path) and songbook_folder != TEMP_FOLDER and "-" in songbook_folder:
-                potential_songbooks.append(songbook_path)
+    def _update_conversion_focus(self):
+        # Convert what the performer is looking at first
+        if self.mode == "home":
+            self._conversion_queue.set_focus(self.focused_songbook.folder)
+        elif self.mode == "songbook" and self.current_songbook is not None:
+            self._conversion_queue.set_focus(
+                self.current_songbook.folder,
+                self.focused_song["path"] if self.focused_song is not None else None
+            )
 
-        songbooks = []
-        for songbook_index, songbook_path in enumerate(potential_songbooks):
-            songbook_folder = os.path.basename(songbook_path)
-            songbook_sequence = songbook_folder.split("-")[0].strip()
-            songbook_title = songbook_folder.split("-")[1].strip()
-            
-            self.update_loading_screen("")
-            self.update_loading_screen("SONGBOOK: " + songbook_title)
-
-
-            # Collect songs for this songbook
-            songs = []
-            for f in sorted(os.listdir(songbook_path)):
-                if f.startswith("~"):
-                    continue
-                if f.endswith("pptx"):
-                    info = f.replace(".pptx", "")
-                    sequence = info.split("-")[0].strip()
-                    artist = info.split("-")[1].strip()
-                    song = info.split("-")[2].strip()
-                    
-                    self.update_loading_screen(f"{artist} - {song}")
-                    song = {
-                        "sequence": sequence,
-                        "artist": artist,
-                        "song": song,
-                        "images": self._presentation_to_images(
-                            os.path.join(songbook_path, f),
-                            songbook_folder
-                        )
-                    }
-                    songs.append(song)
-
-            # Collect songbooks
-            songbooks.append({
-                "sequence": songbook_sequence,
-                "title": songbook_title,
-                "songs": songs,
-                "index": songbook_index
-            })
-        return songbooks
-    
     def update_loading_screen(self, message, append=False):
+        # Called from the conversion workers as well
         self.ids["loading_screen"].draw_text(message, append=append)
 
+    def _count_songs(self):
+        self._songs_total = sum(len(songbook.songs) for songbook in self.songbooks)
+        self._songs_done = sum(
+            1 for songbook in self.songbooks for song in songbook.songs if song["state"] != "converting"
+        )
+        self.ids["loading_screen"].set_progress(self._songs_done, self._songs_total)
+
     def initialize_home(self):
+        with timings.span("build_home"):
 
-        # Create song widgets
-        for songbook in self.songbooks:
-            self.ids["home_layout"].add_widget(songbook)
+            # Create song widgets
+            for songbook in self.songbooks:
+                self.ids["home_layout"].add_widget(songbook)
 
-        # Focus first
-        self.songbooks[0].focus = True
-        self.focused_songbook = self.songbooks[0]
+            # Focus first
+            self.songbooks[0].focus = True
+            self.focused_songbook = self.songbooks[0]
 
     def initialize_songbook(self, songbook):
-        
-        # Reset
-        self.ids["song_list"].clear_widgets()
-        self._placeholders_num = 0
-        self.ids["song_list"].rows = SONGBOOK_MIN_ROWS_NUM
-        self.ids["song_list"].cols = SONGBOOK_MIN_COLS_NUM
-        
-        # Create song widgets
-        self._song_instances = []
-        for index, c in enumerate(songbook.songs):
-            song_instance = Song(
-                sequence=c["sequence"],
-                artist=c["artist"],
-                song=c["song"],
-                images=c.get("images", []),
-                is_placeholder=c.get("is_placeholder", False),
-                index=index,
-            )
-            self._song_instances.append(song_instance)
-            self.ids["song_list"].add_widget(song_instance)
-
-        # Do we need placeholders ?
-        if len(songbook.songs) < SONGBOOK_MIN_COLS_NUM * SONGBOOK_MIN_ROWS_NUM:
-            to_add = SONGBOOK_MIN_COLS_NUM * SONGBOOK_MIN_ROWS_NUM - len(songbook.songs)
-            self._placeholders_num = to_add
-            while to_add > 0:
-                placeholder_song_instance = (
-                    Song(
-                        is_placeholder=True,
-                        sequence="",
-                        artist="",
-                        song="",
-                        index=len(songbook.songs) + to_add
-                    )
-                )
-                self._song_instances.append(placeholder_song_instance)
-                self.ids["song_list"].add_widget(placeholder_song_instance)
-                to_add = to_add - 1
-        else:
-            # Need to increase grid space
-            rows_needed = len(songbook.songs) // SONGBOOK_MIN_COLS_NUM
-            self.ids["song_list"].rows = rows_needed + 1
+        with timings.span("build_songbook"):
+
+            # Songbooks opened before keep their data, focus and scroll position. Opening one again only swaps
+            # these in. Rebuilt when the songs changed, the focus then stays on the same song if it is still there
+            songbook_state = self._songbook_states.get(songbook.folder)
+            if songbook_state is None or songbook_state["songs"] is not songbook.songs:
+                focused_index = 0 if songbook.songs else None
+                if songbook_state is not None and songbook_state["focused_index"] is not None:
+                    focused_path = songbook_state["songs"][songbook_state["focused_index"]]["path"]
+                    paths = [song["path"] for song in songbook.songs]
+                    if focused_path in paths:
+                        focused_index = paths.index(focused_path)
+                songbook_state = {
+                    "songs": songbook.songs,
+                    "data": [SongList.song_data(index, song) for index, song in enumerate(songbook.songs)],
+                    "focused_index": focused_index,
+                    "scroll_y": 1,
+                }
+                self._songbook_states[songbook.folder] = songbook_state
+
+            self._songs = songbook.songs
+            self._focused_song_index = None
+            self.ids["song_list"].data = songbook_state["data"]
+            self.ids["song_list"].scroll_y = songbook_state["scroll_y"]
+            self.ids["prompt_layout"].all_songs = self._songs
+            self._focus_song(songbook_state["focused_index"])
+
+    def _watch_songbooks(self, inotify):
+        # Runs in its own thread. Changes usually come in bursts (copying a folder, saving from
+        # LibreOffice) so wait until it is quiet before rescanning
+        reload_at = None
+        while True:
+            timeout = None if reload_at is None else max(0, reload_at - time.monotonic())
+            try:
+                events = inotify.read(timeout)
+            except OSError as e:
+                print("Error while watching songbooks: {}".format(e))
+                return
+
+            for watched_path, name, mask in events:
+                if watched_path is None:
+                    continue
+                if watched_path == self.songbooks_path:
+                    # A songbook folder
+                    if not (mask & IN_ISDIR) or not self._converter.is_songbook_folder(name):
+                        continue
+                    if mask & (IN_CREATE | IN_MOVED_TO):
+                        self._watch_folder(inotify, os.path.join(watched_path, name), True)
+                elif os.path.dirname(watched_path) == self.songbooks_path:
+                    # A song file or image folder song
+                    if mask & IN_ISDIR:
+                        if mask & (IN_CREATE | IN_MOVED_TO):
+                            self._watch_folder(inotify, os.path.join(watched_path, name), False)
+                    elif not self._converter.is_song_file(name) or mask & IN_CREATE:
+                        # Files are reloaded once written
+                        continue
+                elif not name.lower().endswith(IMAGE_EXTENSIONS) or mask & IN_CREATE:
+                    # An image of an image folder song
+                    continue
+                reload_at = time.monotonic() + HOT_RELOAD_DEBOUNCE
 
+            if reload_at is not None and time.monotonic() >= reload_at:
+                reload_at = None
+                songbook_dicts = self._converter.load_songbooks()
+                Clock.schedule_once(lambda dt, _songbooks=songbook_dicts: self._apply_songbooks_reload(_songbooks))
+
+    def _watch_folder(self, inotify, path, songbook):
+        """Watches a songbook folder and the image folder songs in it, or a single image folder song"""
+        try:
+            inotify.add_watch(path, SONGBOOK_WATCH_MASK)
+            if songbook:
+                for name in os.listdir(path):
+                    if self._converter.is_song_folder(path, name):
+                        inotify.add_watch(os.path.join(path, name), SONGBOOK_WATCH_MASK)
+        except OSError as e:
+            print("Error while watching {}: {}".format(path, e))
+
+    def _apply_songbooks_reload(self, songbook_dicts):
+        if self.mode in ("loading", "prompt"):
+            # Do not pull the songs from under the performer, apply when leaving
+            self._pending_reload = songbook_dicts
+            return
+        if not songbook_dicts:
+            print("No songbooks found, keeping the current ones")
+            return
+
+        # Keep what did not change so that conversion state and widgets survive
+        old_songs = {song["path"]: song for songbook in self.songbooks for song in songbook.songs}
+        new_paths = set()
+        for songbook_dict in songbook_dicts:
+            for i, song in enumerate(songbook_dict["songs"]):
+                new_paths.add(song["path"])
+                if song["images"] and song["images"][0].lower().endswith(IMAGE_EXTENSIONS):
+                    # An image folder song's image may have been replaced under the same name
+                    self.ids["prompt_layout"].forget_slides(song["images"])
+                old_song = old_songs.get(song["path"])
+                if old_song is None:
+                    if song["state"] == "converting":
+                        self._conversion_queue.add(song)
+                    continue
+                if song["state"] == "converting" and old_song["state"] != "converting":
+                    # Either the file changed or its conversion finished while we were scanning
+                    try:
+                        images = self._manifest.lookup(song["path"], self._converter.render_key)
+                    except Exception as e:
+                        print("Error during cache lookup: {}".format(e))
+                        images = None
+                    if images is None:
+                        self._conversion_queue.add(song)
+                        continue
+                elif song["state"] != "converting" and (song["state"], song["images"]) != (old_song["state"], old_song["images"]):
+                    # Changed images, e.g. of an image folder song
+                    continue
+                songbook_dict["songs"][i] = old_song
+        self._conversion_queue.remove(set(old_songs) - new_paths)
+
+        old_songbooks = {songbook.folder: songbook for songbook in self.songbooks}
+        songbooks = []
+        for songbook_dict in songbook_dicts:
+            songbook = old_songbooks.get(songbook_dict["folder"])
+            if songbook is None:
+                songbook = Songbook(focus=False, folder=songbook_dict["folder"])
+            songbook.sequence = songbook_dict["sequence"]
+            songbook.title = songbook_dict["title"]
+            songbook.index = songbook_dict["index"]
+            if songbook.songs != songbook_dict["songs"]:
+                songbook.songs = songbook_dict["songs"]
+            songbooks.append(songbook)
+        self.songbooks = songbooks
+        self._songbook_states = {
+            songbook.folder: self._songbook_states[songbook.folder]
+            for songbook in self.songbooks if songbook.folder in self._songbook_states
+        }
+
+        self._count_songs()
+
+        # Redraw home screen and keep focus where it was if possible
+        self.ids["home_layout"].clear_widgets()
+        for songbook in self.songbooks:
+            self.ids["home_layout"].add_widget(songbook)
+        if self.focused_songbook not in self.songbooks:
+            self.focused_songbook = self.songbooks[0]
+        for songbook in self.songbooks:
+            songbook.focus = songbook is self.focused_songbook
+
+        if self.mode == "songbook":
+            if self.current_songbook not in self.songbooks:
+                self.current_songbook = self.focused_songbook
+                self.set_mode("home")
+            elif self._songs is not self.current_songbook.songs:
+                back_button_focus = self.ids["back_button"].focus
+                self.initialize_songbook(self.current_songbook)
+                if back_button_focus:
+                    self._focus_song(None)
+        elif self.current_songbook not in self.songbooks:
+            self.current_songbook = self.focused_songbook
+        self._update_conversion_focus()
 
-        # Focus first song
-        self._song_instances[0].focus = True
-        self.focused_song = self._song_instances[0]
-        
-        self.ids["prompt_layout"].all_songs = self._song_instances
-        self.ids["prompt_layout"].placeholders_num = self._placeholders_num
-    
     def load_and_draw(self):
 
         def _draw(_songbooks):
@@ -662,25 +1347,58 @@ class TeleprompterWidget(FloatLayout):
                 self.songbooks.append(Songbook(
                     sequence=songbook_dict["sequence"],
                     title=songbook_dict["title"],
+                    folder=songbook_dict["folder"],
                     songs=songbook_dict["songs"],
                     index=songbook_dict["index"],
                     focus=False
                 ))
             self.current_songbook = self.songbooks[0] if self.songbooks else None
+            self._count_songs()
             self.initialize_home()
             self.set_mode("home")
-        
+            self._update_conversion_focus()
+            timings.record("startup_to_home", time.perf_counter() - self._started, self._started)
+            self._start_sync()
+
+            # Convert whatever is not in the cache in the background
+            to_convert = [song for songbook_dict in _songbooks for song in songbook_dict["songs"] if song["state"] == "converting"]
+            for song in to_convert:
+                self._conversion_queue.add(song)
+            if not to_convert:
+                self._on_conversion_idle()
+
+        # Start watching before scanning so that nothing changed in between is missed
+        inotify = None
+        if HOT_RELOAD:
+            try:
+                inotify = Inotify()
+                inotify.add_watch(self.songbooks_path, SONGBOOKS_WATCH_MASK)
+                for songbook_folder in os.listdir(self.songbooks_path):
+                    if self._converter.is_songbook_folder(songbook_folder):
+                        self._watch_folder(inotify, os.path.join(self.songbooks_path, songbook_folder), True)
+            except OSError as e:
+                print("Error while watching songbooks, hot reload disabled: {}".format(e))
+                inotify = None
+
+        if timings.enabled:
+            self._show_last_timing_report()
+
         # Use Clock otherwise we will not be in the Kivy thread at that point since
         # the whole load_and_draw method is in a separate thread
         self.update_loading_screen("\nLoading songbooks ...")
-        songbook_dicts = self.load_songbooks()
+        songbook_dicts = self._converter.load_songbooks()
         Clock.schedule_once(lambda dt: _draw(songbook_dicts))
 
+        if inotify is not None:
+            self._watch_songbooks(inotify)
+
 
 class TeleprompterApp(App):
     
     TOP_BAR_TO_IMAGE_RATIO = TOP_BAR_TO_IMAGE_RATIO
     BOTTOM_BAR_TO_IMAGE_RATIO = BOTTOM_BAR_TO_IMAGE_RATIO
+    SONGBOOK_MIN_ROWS_NUM = SONGBOOK_MIN_ROWS_NUM
+    SONGBOOK_MIN_COLS_NUM = SONGBOOK_MIN_COLS_NUM
     
     Window.fullscreen = True
     Window.allow_screensaver = False
@@ -690,6 +1408,10 @@ class TeleprompterApp(App):
         main = TeleprompterWidget()
         return main
 
+    def on_stop(self):
+        # Page turns are only known at the end
+        self.root.write_timing_report()
+
 
 if __name__ == "__main__":
     TeleprompterApp().run()
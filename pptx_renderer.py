@@ -0,0 +1,513 @@
+"""
+Renders pptx slides that only contain text on a plain background directly with PIL, without the detour through
+LibreOffice and a PDF. Anything the renderer does not understand raises UnsupportedSlide, the caller then uses
+LibreOffice for that slide.
+"""
+import colorsys
+import re
+import subprocess
+from threading import Lock
+
+from lxml import etree
+from PIL import Image, ImageDraw, ImageFont
+from pptx.enum.shapes import MSO_SHAPE_TYPE
+from pptx.opc.constants import RELATIONSHIP_TYPE as RT
+from pptx.oxml.ns import qn
+
+EMU_PER_POINT = 12700
+DEFAULT_FONT_SIZE_PT = 18
+LINE_HEIGHT = 1.2  # single line spacing relative to the font size
+AUTOFIT_STEP = 0.9  # shrink text by this factor until it fits the shape
+AUTOFIT_MIN_SCALE = 0.2
+
+_font_files = {}
+_font_files_lock = Lock()
+
+
+class UnsupportedSlide(Exception):
+    pass
+
+
+def find_font_file(typeface, bold, italic):
+    # Ask fontconfig, it knows the metric compatible replacements (Arial -> Liberation Sans) as well
+    key = (typeface, bold, italic)
+    with _font_files_lock:
+        if key not in _font_files:
+            pattern = typeface + (":bold" if bold else "") + (":italic" if italic else "")
+            try:
+                result = subprocess.run(["fc-match", "-f", "%{file}", pattern], capture_output=True, text=True)
+                _font_files[key] = result.stdout.strip() or None
+            except FileNotFoundError:
+                _font_files[key] = None
+        font_file = _font_files[key]
+    if font_file is None:
+        raise UnsupportedSlide(f"no font found for {typeface}")
+    return font_file
+
+
+def _local(element):
+    return etree.QName(element).localname
+
+
+class PresentationRenderer:
+
+    def __init__(self, presentation, render_size):
+        self.presentation = presentation
+        self.scale = min(
+            render_size[0] / presentation.slide_width,
+            render_size[1] / presentation.slide_height
+        )  # pixels per EMU
+        self.size = (round(presentation.slide_width * self.scale), round(presentation.slide_height * self.scale))
+        self._fonts = {}
+
+        # Presentation wide text defaults
+        default_style = presentation.part._element.find(qn("p:defaultTextStyle"))
+        self._default_rpr = None
+        if default_style is not None:
+            self._default_rpr = default_style.find(f"{qn('a:lvl1pPr')}/{qn('a:defRPr')}")
+
+    """
+    Theme
+    """
+
+    def _load_master(self, master):
+        # Colour scheme, fonts and background styles of the theme used by the master
+        theme = etree.fromstring(master.part.part_related_by(RT.THEME).blob)
+        theme_elements = theme.find(qn("a:themeElements"))
+
+        colors = {}
+        for color in theme_elements.find(qn("a:clrScheme")):
+            rgb = self._color_value(color[0], {}, {})
+            colors[_local(color)] = rgb
+
+        fonts = {}
+        font_scheme = theme_elements.find(qn("a:fontScheme"))
+        for name, key in (("a:minorFont", "+mn-lt"), ("a:majorFont", "+mj-lt")):
+            latin = font_scheme.find(f"{qn(name)}/{qn('a:latin')}")
+            if latin is not None:
+                fonts[key] = latin.get("typeface")
+
+        background_styles = theme_elements.find(f"{qn('a:fmtScheme')}/{qn('a:bgFillStyleLst')}")
+        color_map = dict(master._element.find(qn("p:clrMap")).attrib)
+        return colors, fonts, list(background_styles) if background_styles is not None else [], color_map
+
+    """
+    Colours
+    """
+
+    def _color_value(self, color, colors, color_map, placeholder_color=None):
+        name = _local(color)
+        if name == "srgbClr":
+            rgb = color.get("val")
+        elif name == "sysClr":
+            rgb = color.get("lastClr")
+        elif name == "schemeClr":
+            if color.get("val") == "phClr":
+                if placeholder_color is None:
+                    raise UnsupportedSlide("placeholder colour without a reference")
+                rgb = placeholder_color
+            else:
+                rgb = colors.get(color_map.get(color.get("val"), color.get("val")))
+        else:
+            raise UnsupportedSlide(f"colour {name}")
+        if rgb is None:
+            raise UnsupportedSlide("unknown theme colour")
+        if isinstance(rgb, str):
+            rgb = tuple(int(rgb[i:i + 2], 16) for i in (0, 2, 4))
+
+        # Brightness as set by the colour picker. Anything else (tint, shade, saturation, ...) is left to LibreOffice
+        lum_mod = 1
+        lum_off = 0
+        for modifier in color:
+            modifier_name = _local(modifier)
+            if modifier_name == "lumMod":
+                lum_mod = int(modifier.get("val")) / 100000
+            elif modifier_name == "lumOff":
+                lum_off = int(modifier.get("val")) / 100000
+            elif modifier_name == "alpha" and modifier.get("val") == "100000":
+                pass
+            else:
+                raise UnsupportedSlide(f"colour modifier {modifier_name}")
+        if lum_mod != 1 or lum_off != 0:
+            hue, lightness, saturation = colorsys.rgb_to_hls(*(c / 255 for c in rgb))
+            lightness = min(1, max(0, lightness * lum_mod + lum_off))
+            rgb = tuple(round(c * 255) for c in colorsys.hls_to_rgb(hue, lightness, saturation))
+        return rgb
+
+    def _fill_color(self, parent, colors, color_map):
+        # Colour of the solid fill inside of parent. None if there is no fill at all
+        for child in parent:
+            name = _local(child)
+            if name == "solidFill":
+                return self._color_value(child[0], colors, color_map)
+            if name == "noFill":
+                return None
+            if name in ("gradFill", "blipFill", "pattFill", "grpFill"):
+                raise UnsupportedSlide(name)
+        return None
+
+    def _background_color(self, slide, colors, background_styles, color_map):
+        for part in (slide, slide.slide_layout, slide.slide_layout.slide_master):
+            background = part._element.find(f"{qn('p:cSld')}/{qn('p:bg')}")
+            if background is None:
+                continue
+            properties = background.find(qn("p:bgPr"))
+            if properties is not None:
+                color = self._fill_color(properties, colors, color_map)
+                return color if color is not None else (255, 255, 255)
+
+            # Reference to a background style of the theme, coloured with the given colour
+            reference = background.find(qn("p:bgRef"))
+            index = int(reference.get("idx")) - 1001
+            if index < 0 or index >= len(background_styles) or _local(background_styles[index]) != "solidFill":
+                raise UnsupportedSlide("background style")
+            reference_color = self._color_value(reference[0], colors, color_map)
+            return self._color_value(background_styles[index][0], colors, color_map, reference_color)
+        return (255, 255, 255)
+
+    """
+    Text
+    """
+
+    def _font(self, typeface, bold, italic, size_px):
+        font_file = find_font_file(typeface, bold, italic)
+        key = (font_file, size_px)
+        if key not in self._fonts:
+            self._fonts[key] = ImageFont.truetype(font_file, size_px)
+        return self._fonts[key]
+
+    def _run_style(self, rpr, shape_font_color, colors, fonts, color_map):
+        # Size in points, bold, italic, typeface, colour and capitals of a text run
+        defaults = self._default_rpr
+        if rpr is None:
+            rpr = etree.Element(qn("a:rPr"))
+
+        for attribute, allowed in (("u", "none"), ("strike", "noStrike"), ("baseline", "0"), ("spc", "0")):
+            if rpr.get(attribute, allowed) != allowed:
+                raise UnsupportedSlide(f"text attribute {attribute}")
+        if rpr.get("cap", "none") not in ("none", "all"):
+            raise UnsupportedSlide("small capitals")
+        for name in ("a:highlight", "a:gradFill", "a:blipFill", "a:pattFill"):
+            if rpr.find(qn(name)) is not None:
+                raise UnsupportedSlide(f"text with {name}")
+
+        size = rpr.get("sz")
+        if size is None and defaults is not None:
+            size = defaults.get("sz")
+        size = int(size) / 100 if size is not None else DEFAULT_FONT_SIZE_PT
+
+        color = None
+        for source in (rpr, defaults):
+            if source is not None and source.find(qn("a:solidFill")) is not None:
+                color = self._fill_color(source, colors, color_map)
+                break
+            if source is rpr and shape_font_color is not None:
+                color = shape_font_color
+                break
+        if color is None:
+            color = self._color_value(etree.Element(qn("a:schemeClr"), val="tx1"), colors, color_map)
+
+        typeface = None
+        for source in (rpr, defaults):
+            latin = source.find(qn("a:latin")) if source is not None else None
+            if latin is not None:
+                typeface = latin.get("typeface")
+                break
+        typeface = fonts.get(typeface or "+mn-lt", typeface)
+        if typeface is None:
+            raise UnsupportedSlide("no typeface")
+
+        return {
+            "size": size,
+            "bold": rpr.get("b") in ("1", "true"),
+            "italic": rpr.get("i") in ("1", "true"),
+            "typeface": typeface,
+            "color": color,
+            "caps": rpr.get("cap") == "all",
+        }
+
+    def _paragraphs(self, body, shape_font_color, colors, fonts, color_map):
+        # Every paragraph as its layout properties and a list of (text, style) pieces, "\n" for line breaks
+        paragraphs = []
+        last_style = None
+        for p in body.findall(qn("a:p")):
+            ppr = p.find(qn("a:pPr"))
+            if ppr is None:
+                ppr = etree.Element(qn("a:pPr"))
+            if int(ppr.get("lvl", "0")) > 0:
+                raise UnsupportedSlide("indented paragraph level")
+            for bullet in ("a:buChar", "a:buAutoNum", "a:buBlip"):
+                if ppr.find(qn(bullet)) is not None:
+                    raise UnsupportedSlide("bullets")
+
+            # Spacing as (factor of the line height, fixed points)
+            spacing = {}
+            for name in ("a:lnSpc", "a:spcBef", "a:spcAft"):
+                element = ppr.find(qn(name))
+                value = (1, None) if name == "a:lnSpc" else (0, None)
+                if element is not None:
+                    percent = element.find(qn("a:spcPct"))
+                    points = element.find(qn("a:spcPts"))
+                    if percent is not None:
+                        value = (int(percent.get("val")) / 100000, None)
+                    elif points is not None:
+                        value = (0, int(points.get("val")) / 100)
+                spacing[name] = value
+
+            pieces = []
+            for child in p:
+                name = _local(child)
+                if name in ("r", "fld"):
+                    style = self._run_style(child.find(qn("a:rPr")), shape_font_color, colors, fonts, color_map)
+                    text = child.findtext(qn("a:t")) or ""
+                    pieces.append((text.upper() if style["caps"] else text, style))
+                    last_style = style
+                elif name == "br":
+                    style = self._run_style(child.find(qn("a:rPr")), shape_font_color, colors, fonts, color_map)
+                    pieces.append(("\n", style))
+                    last_style = style
+
+            end_rpr = p.find(qn("a:endParaRPr"))
+            if end_rpr is not None or last_style is None:
+                end_style = self._run_style(end_rpr, shape_font_color, colors, fonts, color_map)
+            else:
+                end_style = last_style
+
+            paragraphs.append({
+                "align": ppr.get("algn", "l"),
+                "margin_left": int(ppr.get("marL", "0")),
+                "indent": int(ppr.get("indent", "0")),
+                "line_spacing": spacing["a:lnSpc"],
+                "space_before": spacing["a:spcBef"],
+                "space_after": spacing["a:spcAft"],
+                "pieces": pieces,
+                "end_style": end_style,
+            })
+        return paragraphs
+
+    def _size_px(self, style, font_scale):
+        return max(1, round(style["size"] * font_scale * EMU_PER_POINT * self.scale))
+
+    def _piece_font(self, style, font_scale):
+        return self._font(style["typeface"], style["bold"], style["italic"], self._size_px(style, font_scale))
+
+    def _spacing_px(self, value, size_px, line_spacing_reduction=0):
+        factor, points = value
+        if points is not None:
+            return points * EMU_PER_POINT * self.scale
+        return size_px * LINE_HEIGHT * factor * (1 - line_spacing_reduction)
+
+    def _layout_lines(self, paragraphs, width, font_scale, line_spacing_reduction):
+        # Breaks paragraphs into lines. Space between paragraphs is given as gap entries
+        lines = []
+        for paragraph in paragraphs:
+            end_size_px = self._size_px(paragraph["end_style"], font_scale)
+            margin = paragraph["margin_left"] * self.scale
+            indent = paragraph["indent"] * self.scale
+
+            space_before = self._spacing_px(paragraph["space_before"], end_size_px)
+            if space_before:
+                lines.append({"gap": space_before})
+
+            # Greedy line breaking on whitespace. Pieces are (text, style, width, font)
+            broken = [[]]
+            line_width = 0
+            wrapped = False
+            for text, style in paragraph["pieces"]:
+                if text == "\n":
+                    broken.append([])
+                    line_width = 0
+                    wrapped = False
+                    continue
+                font = self._piece_font(style, font_scale)
+                for token in re.findall(r"\s+|\S+", text):
+                    token_width = font.getlength(token)
+                    if token.isspace():
+                        # A line that was wrapped does not start with the space it was wrapped at
+                        if wrapped and not broken[-1]:
+                            continue
+                    elif width is not None and broken[-1]:
+                        available = width - margin - (indent if len(broken) == 1 else 0)
+                        if line_width + token_width > available:
+                            broken.append([])
+                            line_width = 0
+                            wrapped = True
+                    broken[-1].append((token, style, token_width, font))
+                    line_width = line_width + token_width
+
+            for number, pieces in enumerate(broken):
+                # Trailing spaces do not count for alignment
+                visible = list(pieces)
+                while visible and visible[-1][0].isspace():
+                    visible.pop()
+                size_px = max([self._size_px(style, font_scale) for _, style, _, _ in pieces] or [end_size_px])
+                fonts = [font for _, _, _, font in pieces] or [self._piece_font(paragraph["end_style"], font_scale)]
+                lines.append({
+                    "pieces": pieces,
+                    "width": sum(piece_width for _, _, piece_width, _ in visible),
+                    "height": self._spacing_px(paragraph["line_spacing"], size_px, line_spacing_reduction),
+                    "ascent": max(font.getmetrics()[0] for font in fonts),
+                    "align": paragraph["align"],
+                    "offset": margin + (indent if number == 0 else 0),
+                })
+
+            space_after = self._spacing_px(paragraph["space_after"], end_size_px)
+            if space_after:
+                lines.append({"gap": space_after})
+        return lines
+
+    @staticmethod
+    def _place_in_columns(lines, columns, height):
+        # Fill columns top to bottom. Returns a list of lines per column, None if the text does not fit
+        placed = [[]]
+        used = 0
+        for line in lines:
+            line_height = line.get("gap", line.get("height"))
+            if used + line_height > height + 0.5 and placed[-1]:
+                if len(placed) == columns:
+                    return None
+                placed.append([])
+                used = 0
+                if "gap" in line:
+                    continue
+            placed[-1].append(line)
+            used = used + line_height
+        return placed
+
+    def _draw_text(self, draw, shape, colors, fonts, color_map, shape_font_color):
+        body = shape._element.find(qn("p:txBody"))
+        body_properties = body.find(qn("a:bodyPr"))
+        if body_properties.get("vert", "horz") != "horz":
+            raise UnsupportedSlide("vertical text")
+        warp = body_properties.find(qn("a:prstTxWarp"))
+        if warp is not None and warp.get("prst") != "textNoShape":
+            raise UnsupportedSlide("warped text")
+        list_style = body.find(qn("a:lstStyle"))
+        if list_style is not None and len(list_style):
+            raise UnsupportedSlide("text list styles")
+
+        left = (shape.left + int(body_properties.get("lIns", "91440"))) * self.scale
+        top = (shape.top + int(body_properties.get("tIns", "45720"))) * self.scale
+        width = (shape.width - int(body_properties.get("lIns", "91440")) - int(body_properties.get("rIns", "91440"))) * self.scale
+        height = (shape.height - int(body_properties.get("tIns", "45720")) - int(body_properties.get("bIns", "45720"))) * self.scale
+        columns = int(body_properties.get("numCol", "1"))
+        column_spacing = int(body_properties.get("spcCol", "0")) * self.scale
+        column_width = (width - column_spacing * (columns - 1)) / columns
+        wrap = body_properties.get("wrap", "square") != "none"
+
+        # Shrink text on overflow
+        font_scale = 1
+        line_spacing_reduction = 0
+        shrink = False
+        autofit = body_properties.find(qn("a:normAutofit"))
+        if autofit is not None:
+            shrink = True
+            font_scale = int(autofit.get("fontScale", "100000")) / 100000
+            line_spacing_reduction = int(autofit.get("lnSpcReduction", "0")) / 100000
+
+        paragraphs = self._paragraphs(body, shape_font_color, colors, fonts, color_map)
+        while True:
+            lines = self._layout_lines(paragraphs, column_width if wrap else None, font_scale, line_spacing_reduction)
+            placed = self._place_in_columns(lines, columns, height)
+            if placed is not None:
+                break
+            if not shrink or font_scale <= AUTOFIT_MIN_SCALE:
+                # Overflowing text is drawn below the shape, like PowerPoint does
+                placed = [lines]
+                break
+            font_scale = font_scale * AUTOFIT_STEP
+
+        # Columns are anchored together, by their tallest one
+        block_height = max(sum(line.get("gap", line.get("height")) for line in column) for column in placed)
+        anchor = body_properties.get("anchor", "t")
+        if anchor == "ctr":
+            top = top + (height - block_height) / 2
+        elif anchor == "b":
+            top = top + height - block_height
+
+        for column_index, column in enumerate(placed):
+            x_column = left + column_index * (column_width + column_spacing)
+            y = top
+            for line in column:
+                if "gap" in line:
+                    y = y + line["gap"]
+                    continue
+                x = x_column + line["offset"]
+                available = column_width - line["offset"]
+                if line["align"] == "ctr":
+                    x = x + (available - line["width"]) / 2
+                elif line["align"] == "r":
+                    x = x + available - line["width"]
+                baseline = y + line["ascent"]
+                for text, style, text_width, font in line["pieces"]:
+                    draw.text((x, baseline), text, font=font, fill=style["color"], anchor="ls")
+                    x = x + text_width
+                y = y + line["height"]
+
+    """
+    Slides
+    """
+
+    def _shape_style_color(self, shape, name, colors, color_map):
+        # Theme style of autoshapes: fill, line and font reference with an index (0 = none) and a colour
+        style = shape._element.find(qn("p:style"))
+        reference = style.find(qn(f"a:{name}")) if style is not None else None
+        if reference is None or len(reference) == 0:
+            return None, None
+        return reference.get("idx"), self._color_value(reference[0], colors, color_map)
+
+    def render(self, slide):
+        master = slide.slide_layout.slide_master
+        colors, fonts, background_styles, color_map = self._load_master(master)
+        override = slide._element.find(f"{qn('p:clrMapOvr')}/{qn('a:overrideClrMapping')}")
+        if override is not None:
+            color_map = dict(override.attrib)
+
+        # Shapes of layout and master are drawn on the slide as well. Their placeholders are not
+        if slide._element.get("showMasterSp") != "0":
+            for inherited in list(slide.slide_layout.shapes) + list(master.shapes):
+                if not inherited.is_placeholder:
+                    raise UnsupportedSlide("layout or master with shapes")
+
+        image = Image.new("RGB", self.size, self._background_color(slide, colors, background_styles, color_map))
+        draw = ImageDraw.Draw(image)
+
+        for shape in slide.shapes:
+            if shape.is_placeholder:
+                # Empty placeholders are not shown, text in them inherits styles from the master
+                if shape.has_text_frame and not shape.text_frame.text.strip():
+                    continue
+                raise UnsupportedSlide("text in placeholder")
+            if shape.shape_type not in (MSO_SHAPE_TYPE.AUTO_SHAPE, MSO_SHAPE_TYPE.TEXT_BOX) or not shape.has_text_frame:
+                raise UnsupportedSlide(f"shape {shape.shape_type}")
+            if shape.rotation:
+                raise UnsupportedSlide("rotated shape")
+
+            shape_properties = shape._element.spPr
+            fill_index, fill_color = self._shape_style_color(shape, "fillRef", colors, color_map)
+            line_index, _ = self._shape_style_color(shape, "lnRef", colors, color_map)
+            _, shape_font_color = self._shape_style_color(shape, "fontRef", colors, color_map)
+
+            # Only rectangles filled with a plain colour, and no outlines
+            if any(_local(child) in ("solidFill", "noFill", "gradFill", "blipFill", "pattFill", "grpFill") for child in shape_properties):
+                fill_color = self._fill_color(shape_properties, colors, color_map)
+            elif fill_index in (None, "0"):
+                fill_color = None
+            line = shape_properties.find(qn("a:ln"))
+            if line is not None and line.find(qn("a:noFill")) is None:
+                raise UnsupportedSlide("shape outline")
+            if line is None and line_index not in (None, "0"):
+                raise UnsupportedSlide("shape outline")
+            geometry = shape_properties.find(qn("a:prstGeom"))
+            if fill_color is not None:
+                if geometry is None or geometry.get("prst") != "rect":
+                    raise UnsupportedSlide("filled shape that is not a rectangle")
+                draw.rectangle(
+                    (shape.left * self.scale, shape.top * self.scale,
+                     (shape.left + shape.width) * self.scale, (shape.top + shape.height) * self.scale),
+                    fill=fill_color
+                )
+
+            self._draw_text(draw, shape, colors, fonts, color_map, shape_font_color)
+
+        return image
@@ -0,0 +1,122 @@
+"""
+Converts all songbooks without starting the app, so that it starts on a warm cache. Run after pulling new songbooks:
+
+    python prebuild.py [--size 1920x1036] [--workers 4] [--prune] [--timings report.json] [--export-bundle [FILE]]
+
+Slides found in the cache bundle of the songbooks are unpacked instead of converted. --export-bundle writes that bundle,
+e.g. on a fast machine with the size of the Pi's screen, to be committed to the songbooks repo.
+Exits with 1 if a presentation could not be converted.
+"""
+import argparse
+import os
+import sys
+import time
+from threading import Event, Lock
+
+from converter import CACHE_BUNDLE_FILE, CONVERSION_WORKERS, PACKED_SLIDES, ConversionQueue, SongbookConverter, find_songbooks_path
+from timing import timings
+
+
+def parse_size(value):
+    try:
+        width, height = value.lower().split("x")
+        return int(width), int(height)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"expected WIDTHxHEIGHT, got {value}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Convert all songbooks into slides for the teleprompter")
+    parser.add_argument("--songbooks", help="songbooks folder, found like the app does by default")
+    parser.add_argument(
+        "--size", type=parse_size,
+        help="slide size in pixels, by default the size the app used last time"
+    )
+    parser.add_argument(
+        "--workers", type=int, default=CONVERSION_WORKERS or os.cpu_count() or 1,
+        help="presentations converted in parallel"
+    )
+    parser.add_argument("--prune", action="store_true", help="delete converted slides nobody uses anymore")
+    parser.add_argument("--timings", metavar="FILE", help="write a JSON report of where the time went")
+    parser.add_argument(
+        "--export-bundle", metavar="FILE", nargs="?", const="",
+        help=f"pack all converted slides into a cache bundle, by default {CACHE_BUNDLE_FILE} in the songbooks folder"
+    )
+    args = parser.parse_args()
+    timings.enabled = bool(args.timings)
+
+    songbooks_path = args.songbooks or find_songbooks_path()
+    converter = SongbookConverter(songbooks_path)
+    render_size = args.size or converter.manifest.render_size
+    if render_size is None:
+        print("Slide size unknown, the app was never started. Pass --size WIDTHxHEIGHT")
+        return 2
+    converter.set_render_size(render_size)
+
+    songs = [song for songbook in converter.load_songbooks() for song in songbook["songs"]]
+    to_convert = [song for song in songs if song["state"] == "converting"]
+    print(f"{len(songs)} songs, {len(to_convert)} to convert at {render_size[0]}x{render_size[1]}")
+
+    failed = []
+    print_lock = Lock()
+    done = Event()
+    started = time.monotonic()
+    queue = None
+
+    def _convert(song, work_dir):
+        song_started = time.monotonic()
+        images = converter.convert_song(song, work_dir, queue.workers_busy)
+        with print_lock:
+            print(f"{time.monotonic() - song_started:7.2f}s  {converter.song_label(song)} ({len(images)} slides)")
+        return images
+
+    def _on_done(song, images, error):
+        if error is None and converter.manifest.changed_since_stored(song["path"]):
+            with print_lock:
+                print(f"{'changed':>8}  {converter.song_label(song)}, converting again")
+            queue.add(song)
+        elif error is not None:
+            with print_lock:
+                print(f"{'failed':>8}  {converter.song_label(song)}: {error}")
+            failed.append(song)
+
+    def _on_idle():
+        converter.manifest.save()
+        done.set()
+
+    if to_convert:
+        queue = ConversionQueue(_convert, _on_done, _on_idle, max(1, args.workers))
+        for song in to_convert:
+            queue.add(song)
+        done.wait()
+        converter.office.close()
+        print(f"Converted {len(to_convert) - len(failed)} of {len(to_convert)} in {time.monotonic() - started:.2f}s")
+
+    if PACKED_SLIDES:
+        packed = converter.manifest.pack()
+        if packed:
+            print(f"Packed the slides of {len(packed)} songbooks" + ("" if args.prune else ", --prune deletes the loose ones"))
+
+    if args.prune and converter.app_running():
+        print("Not pruning, the app is running and may still show the slides. Run again with --prune once it is closed")
+    elif args.prune:
+        deleted = converter.manifest.prune([song["path"] for song in songs])
+        print(f"Pruned {len(deleted)} files")
+
+    # Also keeps what the scan updated, e.g. the modification time of a presentation touched by git
+    converter.manifest.save()
+
+    if args.export_bundle is not None:
+        bundle_path = os.path.abspath(args.export_bundle) if args.export_bundle else None
+        exported_songs, exported_slides = converter.export_bundle(songs, bundle_path)
+        print(f"Exported {exported_songs} songs ({exported_slides} slides) to {bundle_path or converter.bundle.path}")
+
+    if args.timings:
+        timings.write(os.path.abspath(args.timings), render_size=render_size)
+        print("\n".join(timings.summary()))
+
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
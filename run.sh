@@ -17,4 +17,9 @@ git pull
 echo "Starting Telepromter in ${script_dir}"
 cd "${script_dir}"
 git pull
+
+# Convert new or changed presentations before the app starts. Songs that fail are shown as failed in the app
+echo "Converting songbooks"
+$script_dir/.venv/bin/python3 $script_dir/prebuild.py --prune || echo "Some presentations could not be converted"
+
 $script_dir/.venv/bin/python3 $script_dir/main.py
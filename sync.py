@@ -0,0 +1,218 @@
+"""
+Keeps several prompters on the same slide. The leader sends its navigation state (songbook, song, slide) as small
+JSON datagrams over UDP, followers show the same from their own converted slides. Every message carries the whole
+state and a sequence number, so a follower just applies the newest one it gets. The leader sends the state again
+every few hundred milliseconds, a lost or reordered packet is corrected by the next one.
+
+Followers acknowledge every change, the leader measures the round trip. Followers measure the latency from the
+leader's send time, which needs the clocks in sync (NTP) unless both run on the same machine.
+
+    python sync.py --loopback [--messages 500] [--loss 0.2]
+
+runs a leader and a follower in one process over 127.0.0.1 with simulated packet loss and prints the latency and
+how long the follower was behind. No network needed.
+"""
+import argparse
+import json
+import os
+import random
+import socket
+import sys
+import time
+from threading import Event, Lock, Thread
+
+VERSION = 1
+
+
+class SyncLeader:
+    """Sends states to followers. on_round_trip(follower address, seconds) is called from a background thread"""
+
+    def __init__(self, address, port, on_round_trip=None, loss=0):
+        self._socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self._socket.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
+        self._socket.bind(("", 0))  # acknowledgements come back here
+        self._target = (address, port)
+        self._session = os.urandom(4).hex()  # followers notice a restarted leader
+        self._sequence = 0
+        self._lock = Lock()
+        self._sent = {}  # by sequence, perf counter time for the round trip of the acknowledgement
+        self.on_round_trip = on_round_trip
+        self.loss = loss  # part of the messages dropped on purpose, for the loopback test
+        Thread(target=self._read_acknowledgements, daemon=True).start()
+
+    def send(self, state, resend=False):
+        """resend marks a periodic repetition, followers do not acknowledge it"""
+        with self._lock:
+            self._sequence = self._sequence + 1
+            message = {
+                "version": VERSION,
+                "session": self._session,
+                "sequence": self._sequence,
+                "sent": time.time(),
+                "resend": resend,
+                "state": state,
+            }
+            if not resend:
+                self._sent[self._sequence] = time.perf_counter()
+                # Only the recent ones can still be acknowledged
+                for sequence in [sequence for sequence in self._sent if sequence < self._sequence - 64]:
+                    del self._sent[sequence]
+        if self.loss and random.random() < self.loss:
+            return
+        try:
+            self._socket.sendto(json.dumps(message).encode(), self._target)
+        except OSError as e:
+            print("Error during sync sending: {}".format(e))
+
+    def _read_acknowledgements(self):
+        while True:
+            try:
+                data, address = self._socket.recvfrom(64 * 1024)
+                acknowledgement = json.loads(data)
+            except (OSError, ValueError):
+                continue
+            if not isinstance(acknowledgement, dict) or not isinstance(acknowledgement.get("sequence"), int):
+                continue
+            with self._lock:
+                sent = self._sent.pop(acknowledgement["sequence"], None)
+            if sent is not None and self.on_round_trip:
+                self.on_round_trip(address, time.perf_counter() - sent)
+
+    def close(self):
+        self._socket.close()
+
+
+class SyncFollower:
+    """
+    Receives states of a leader. on_message(message, leader address) is called from a background thread for every
+    message newer than the last one, call acknowledge once it is shown
+    """
+
+    def __init__(self, port, on_message):
+        self._socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self._socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._socket.bind(("", port))
+        self._session = None
+        self._sequence = 0
+        self.on_message = on_message
+        Thread(target=self._read, daemon=True).start()
+
+    def _read(self):
+        while True:
+            try:
+                data, address = self._socket.recvfrom(64 * 1024)
+                message = json.loads(data)
+            except (OSError, ValueError):
+                continue
+            if not self._is_valid(message):
+                # Not from a leader of this version, anything could be sent to the port
+                continue
+            if message["session"] == self._session and message["sequence"] <= self._sequence:
+                # Late or duplicate, something newer was applied already
+                continue
+            self._session = message["session"]
+            self._sequence = message["sequence"]
+            self.on_message(message, address)
+
+    @staticmethod
+    def _is_valid(message):
+        return (
+            isinstance(message, dict) and message.get("version") == VERSION
+            and isinstance(message.get("session"), str)
+            and isinstance(message.get("sequence"), int)
+            and isinstance(message.get("sent"), (int, float))
+            and isinstance(message.get("resend"), bool)
+            and isinstance(message.get("state"), dict)
+        )
+
+    def acknowledge(self, message, address):
+        if message["resend"]:
+            return
+        try:
+            self._socket.sendto(json.dumps({"sequence": message["sequence"]}).encode(), address)
+        except OSError as e:
+            print("Error during sync acknowledgement: {}".format(e))
+
+    def close(self):
+        self._socket.close()
+
+
+def loopback_test(messages, interval, resend_interval, loss):
+    """Leader and follower in one process. Returns latency and catch up statistics"""
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as probe:
+        probe.bind(("127.0.0.1", 0))
+        port = probe.getsockname()[1]
+
+    lock = Lock()
+    latencies = []
+    round_trips = []
+    shown = {"slide": None, "since": {}}  # when the follower first showed each slide
+    done = Event()
+
+    def _on_message(message, address):
+        slide = message["state"]["slide"]
+        with lock:
+            if shown["slide"] != slide:
+                shown["slide"] = slide
+                shown["since"].setdefault(slide, time.time())
+                latencies.append(time.time() - message["sent"])
+            if slide == messages - 1:
+                done.set()
+        follower.acknowledge(message, address)
+
+    def _on_round_trip(address, seconds):
+        with lock:
+            round_trips.append(seconds)
+
+    follower = SyncFollower(port, _on_message)
+    leader = SyncLeader("127.0.0.1", port, _on_round_trip, loss)
+    changed = {}
+    last_resend = time.monotonic()
+    for slide in range(messages):
+        changed[slide] = time.time()
+        leader.send({"slide": slide})
+        # Resend the current state while waiting for the next change, like the app does
+        next_change = time.monotonic() + interval
+        while time.monotonic() < next_change:
+            if time.monotonic() - last_resend >= resend_interval:
+                leader.send({"slide": slide}, resend=True)
+                last_resend = time.monotonic()
+            time.sleep(min(0.001, interval))
+    while not done.wait(resend_interval):
+        leader.send({"slide": messages - 1}, resend=True)
+
+    leader.close()
+    follower.close()
+    with lock:
+        behind = sorted(shown["since"][slide] - changed[slide] for slide in shown["since"])
+        latencies = sorted(latencies)
+        round_trips = sorted(round_trips)
+
+    def _ms(values, share):
+        return round(values[min(len(values) - 1, int(len(values) * share))] * 1000, 3) if values else None
+
+    return {
+        "messages": messages,
+        "loss": loss,
+        "shown": len(behind),  # slides the follower showed, the others were skipped over by newer ones
+        "latency_ms": {"median": _ms(latencies, 0.5), "p99": _ms(latencies, 0.99), "max": _ms(latencies, 1)},
+        "round_trip_ms": {"median": _ms(round_trips, 0.5), "max": _ms(round_trips, 1)},
+        "behind_ms": {"median": _ms(behind, 0.5), "max": _ms(behind, 1)},  # from the change until shown
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Loopback test of prompter sync, no network needed")
+    parser.add_argument("--loopback", action="store_true", required=True)
+    parser.add_argument("--messages", type=int, default=500, help="slide changes sent by the leader")
+    parser.add_argument("--interval", type=float, default=0.01, help="seconds between slide changes")
+    parser.add_argument("--resend-interval", type=float, default=0.05, help="seconds between repetitions")
+    parser.add_argument("--loss", type=float, default=0.1, help="part of the packets dropped")
+    args = parser.parse_args()
+    results = loopback_test(args.messages, args.interval, args.resend_interval, args.loss)
+    print(json.dumps(results, indent=1))
+    return 0 if results["shown"] else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
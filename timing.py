@@ -0,0 +1,110 @@
+"""
+Timing spans for startup, conversion and page turns. Disabled by default, spans are then a shared no-op context manager.
+"""
+import json
+import os
+import time
+from contextlib import nullcontext
+from threading import Lock
+
+_DISABLED_SPAN = nullcontext()
+
+
+class _Span:
+
+    def __init__(self, timings, name, labels):
+        self._timings = timings
+        self._name = name
+        self._labels = labels
+
+    def __enter__(self):
+        self._started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._timings.record(self._name, time.perf_counter() - self._started, self._started, **self._labels)
+        return False
+
+
+class Timings:
+    """Collects named spans, e.g. `with timings.span("soffice", file=name):`. Thread safe"""
+
+    def __init__(self):
+        self.enabled = False
+        self._lock = Lock()
+        self._spans = []
+        self._created = time.perf_counter()
+        self._created_wall = time.time()
+
+    def __len__(self):
+        with self._lock:
+            return len(self._spans)
+
+    def span(self, name, **labels):
+        if not self.enabled:
+            return _DISABLED_SPAN
+        return _Span(self, name, labels)
+
+    def record(self, name, duration, started=None, **labels):
+        """Adds a span measured elsewhere. started is a time.perf_counter() value, default is duration ago"""
+        if not self.enabled:
+            return
+        if started is None:
+            started = time.perf_counter() - duration
+        with self._lock:
+            self._spans.append({
+                "name": name,
+                "start": round(started - self._created, 6),
+                "duration": round(duration, 6),
+                **labels,
+            })
+
+    def stats(self):
+        """Per span name: count, total, median and max duration in seconds, in order of first appearance"""
+        with self._lock:
+            spans = list(self._spans)
+        durations = {}
+        for span in spans:
+            durations.setdefault(span["name"], []).append(span["duration"])
+        stats = {}
+        for name, values in durations.items():
+            values.sort()
+            stats[name] = {
+                "count": len(values),
+                "total": round(sum(values), 6),
+                "median": values[len(values) // 2],
+                "max": values[-1],
+            }
+        return stats
+
+    def summary(self):
+        """One line per span name, for the loading screen"""
+        lines = []
+        for name, stat in self.stats().items():
+            if stat["count"] == 1:
+                lines.append(f"{name}: {stat['total'] * 1000:.0f} ms")
+            else:
+                lines.append(
+                    f"{name}: {stat['count']}x, total {stat['total'] * 1000:.0f} ms, "
+                    f"median {stat['median'] * 1000:.0f} ms, max {stat['max'] * 1000:.0f} ms"
+                )
+        return lines
+
+    def write(self, path, **info):
+        """Writes all spans and their stats as JSON. info is added at the top, e.g. the render size"""
+        with self._lock:
+            spans = list(self._spans)
+        report = {
+            "started": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(self._created_wall)),
+            **info,
+            "stats": self.stats(),
+            "spans": spans,
+        }
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(report, f, indent=1)
+        os.replace(tmp_path, path)
+
+
+timings = Timings()